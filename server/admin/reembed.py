@@ -0,0 +1,336 @@
+"""
+Rebuild every user vector with a new embedding model / input type, or into a
+new index or namespace, then switch live reads and writes over to it.
+
+Run from the server directory, on the same box as the API (the switch goes
+through the shared cache file):
+
+    python -m admin.reembed --target-namespace v2 --model llama-text-embed-v2 --input-type passage
+
+Progress is checkpointed after every page; re-running the same command
+resumes where it stopped. Live writes made during the copy are tracked and
+re-copied before the migration finishes. For the switch itself, writes are
+held for a few seconds while the last ones are copied.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+# Same .env as the API; load it before the model modules read their settings.
+load_dotenv()
+
+from model import shared_cache
+from model.pinecone import (
+    ACTIVE_TARGET_TTL_S,
+    MIGRATION_FREEZE_MAX_S,
+    active_target,
+    bio_hash,
+    embed_texts,
+    normalize_bio,
+    placeholder_vector,
+    set_active_target,
+    target_key,
+    index_call,
+)
+
+
+class RateLimiter:
+    """Token bucket shared by all copy threads; caps vectors per second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n: int):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n or self.tokens >= self.rate:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(min(wait, 1.0))
+
+
+def _load_checkpoint(path: str) -> Dict[str, Any] | None:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_checkpoint(path: str, ckpt: Dict[str, Any]):
+    # Write-then-rename so a crash never leaves a half-written checkpoint.
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(ckpt, f)
+    os.replace(tmp, path)
+
+
+def _chunks(items: List[Any], size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def copy_ids(ids: List[str], source: dict, target: dict, args, limiter: RateLimiter) -> tuple[int, List[str]]:
+    """
+    Re-embed and upsert one batch of users from source into target.
+    Returns (copied, failed_ids).
+    """
+    resp = index_call("fetch", target=source, ids=ids)
+    vectors = resp.vectors if hasattr(resp, "vectors") else {}
+
+    records = []
+    for user_id in ids:
+        vec = vectors.get(user_id)
+        if vec is None:
+            continue  # deleted since it was listed
+        meta = dict(getattr(vec, "metadata", None) or {})
+        bio = normalize_bio(meta.get("bio"))
+        h = bio_hash(bio)
+        meta["bio_hash"] = h
+        meta["embed_hash"] = h
+        records.append({"id": user_id, "bio": bio, "metadata": meta})
+
+    failed: List[str] = []
+    to_embed = [r for r in records if r["bio"]]
+    for batch in _chunks(to_embed, args.embed_batch):
+        limiter.acquire(len(batch))
+        try:
+            values = embed_texts([r["bio"] for r in batch], target["embed_model"], target["embed_input_type"])
+        except Exception as e:
+            print(f"[reembed] embed failed for {len(batch)} ids: {repr(e)}")
+            failed.extend(r["id"] for r in batch)
+            continue
+        for r, v in zip(batch, values):
+            r["values"] = v
+    for r in records:
+        if not r["bio"]:
+            # No bio yet: same placeholder the live path writes (model/pinecone.py).
+            r["values"] = placeholder_vector(target)
+            r["metadata"]["embed_hash"] = ""
+
+    ready = [r for r in records if "values" in r]
+    copied = 0
+    for batch in _chunks(ready, args.upsert_batch):
+        try:
+            index_call(
+                "upsert",
+                target=target,
+                vectors=[{"id": r["id"], "values": r["values"], "metadata": r["metadata"]} for r in batch],
+            )
+            copied += len(batch)
+        except Exception as e:
+            print(f"[reembed] upsert failed for {len(batch)} ids: {repr(e)}")
+            failed.extend(r["id"] for r in batch)
+    return copied, failed
+
+
+def _copy_phase(ckpt: Dict[str, Any], source: dict, target: dict, args, limiter: RateLimiter):
+    """
+    Page through every id in source. Pages are copied concurrently, but the
+    checkpoint only advances past a page once it and all pages before it
+    have finished.
+    """
+    token = ckpt.get("pagination_token")
+    pending: deque = deque()
+
+    def commit_head():
+        next_token, fut = pending.popleft()
+        copied, failed = fut.result()
+        ckpt["pagination_token"] = next_token
+        ckpt["pages_done"] += 1
+        ckpt["copied"] += copied
+        ckpt["failed_ids"].extend(failed)
+        _save_checkpoint(args.checkpoint, ckpt)
+        print(f"[reembed] pages={ckpt['pages_done']} copied={ckpt['copied']} failed={len(ckpt['failed_ids'])}")
+
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="reembed") as pool:
+        while True:
+            page = index_call(
+                "list_paginated",
+                target=source,
+                limit=args.page_size,
+                pagination_token=token,
+            )
+            ids = [v.id for v in (page.vectors or [])]
+            pagination = getattr(page, "pagination", None)
+            next_token = getattr(pagination, "next", None) if pagination else None
+            if ids:
+                pending.append((next_token, pool.submit(copy_ids, ids, source, target, args, limiter)))
+            while pending and (pending[0][1].done() or len(pending) >= args.concurrency):
+                commit_head()
+            if not next_token:
+                break
+            token = next_token
+        while pending:
+            commit_head()
+
+
+def _drain_dirty(source: dict, target: dict, args, limiter: RateLimiter) -> tuple[int, List[str]]:
+    """
+    Re-copy every user written live since the last drain. Returns
+    (copied, failed_ids); failed users stay queued for the next drain.
+    """
+    total = 0
+    failed_all: List[str] = []
+    try:
+        while True:
+            ids = shared_cache.take_dirty(args.page_size)
+            if not ids:
+                return total, failed_all
+            copied, failed = copy_ids(ids, source, target, args, limiter)
+            total += copied
+            failed_all.extend(failed)
+    finally:
+        # Re-queued only at the end, so this drain doesn't keep retrying them.
+        if failed_all:
+            shared_cache.requeue_dirty(failed_all)
+
+
+def run(args) -> int:
+    ckpt = None if args.restart else _load_checkpoint(args.checkpoint)
+    if ckpt:
+        # Resuming: the checkpoint pins source and target (the flip may already have happened).
+        source, target = ckpt["source"], ckpt["target"]
+        if ckpt["phase"] == "done":
+            print(f"[reembed] {args.checkpoint} is already finished; use --restart for a new migration")
+            return 0
+        print(f"[reembed] resuming {target_key(source)} -> {target_key(target)} at phase {ckpt['phase']}")
+    else:
+        source = dict(active_target())
+        target = {
+            "index": args.target_index or source["index"],
+            "namespace": args.target_namespace if args.target_namespace is not None else source["namespace"],
+            "embed_model": args.model,
+            "embed_input_type": args.input_type,
+        }
+        if target_key(target) == target_key(source):
+            print("[reembed] target index/namespace must differ from the active one", file=sys.stderr)
+            return 2
+        ckpt = {
+            "source": source,
+            "target": target,
+            "phase": "copy",
+            "pagination_token": None,
+            "pages_done": 0,
+            "copied": 0,
+            "failed_ids": [],
+            "started_at": time.time(),
+        }
+        _save_checkpoint(args.checkpoint, ckpt)
+
+    # From here on, live writes to the source are queued for re-copy. Give every
+    # worker time to see the setting before the first page is copied.
+    migration = {"source": target_key(source), "target": target_key(target)}
+    shared_cache.set_setting("migration", migration)
+    time.sleep(shared_cache.MIGRATION_CHECK_TTL_S + 0.5)
+    limiter = RateLimiter(args.max_rps)
+
+    if ckpt["phase"] == "copy":
+        _copy_phase(ckpt, source, target, args, limiter)
+        ckpt["phase"] = "catchup"
+        _save_checkpoint(args.checkpoint, ckpt)
+
+    if ckpt["phase"] == "catchup":
+        if ckpt["failed_ids"]:
+            retry = list(dict.fromkeys(ckpt["failed_ids"]))
+            print(f"[reembed] retrying {len(retry)} failed ids")
+            ckpt["failed_ids"] = []
+            for batch in _chunks(retry, args.page_size):
+                copied, failed = copy_ids(batch, source, target, args, limiter)
+                ckpt["copied"] += copied
+                ckpt["failed_ids"].extend(failed)
+            _save_checkpoint(args.checkpoint, ckpt)
+            if ckpt["failed_ids"]:
+                print(f"[reembed] {len(ckpt['failed_ids'])} ids still failing; fix and re-run to resume", file=sys.stderr)
+                return 1
+        n, failed = _drain_dirty(source, target, args, limiter)
+        print(f"[reembed] caught up {n} live updates")
+        if failed:
+            print(f"[reembed] {len(failed)} live-updated ids failed to copy: {failed[:10]}; fix and re-run to resume", file=sys.stderr)
+            return 1
+        ckpt["phase"] = "flip"
+        _save_checkpoint(args.checkpoint, ckpt)
+
+    if ckpt["phase"] == "flip":
+        # Hold writes (model/pinecone.py write_target) so the source stops changing,
+        # copy what's left, then switch. Nothing is copied over the target after
+        # workers start writing to it.
+        # Writers give up waiting MIGRATION_FREEZE_MAX_S after frozen_at, so it is set once.
+        frozen_at = time.time()
+        shared_cache.set_setting("migration", {**migration, "frozen": True, "frozen_at": frozen_at})
+        # Writes that checked before the hold finish and mark themselves dirty.
+        time.sleep(shared_cache.MIGRATION_CHECK_TTL_S + ACTIVE_TARGET_TTL_S + 1)
+        n, failed = _drain_dirty(source, target, args, limiter)
+        print(f"[reembed] copied {n} final live updates")
+        if time.time() - frozen_at >= MIGRATION_FREEZE_MAX_S:
+            # Held writers have stopped waiting and may be writing to the source again.
+            shared_cache.set_setting("migration", migration)
+            print(
+                f"[reembed] the final copy took longer than MIGRATION_FREEZE_MAX_S ({MIGRATION_FREEZE_MAX_S:.0f}s); "
+                "writes released, re-run to retry the switch",
+                file=sys.stderr,
+            )
+            return 1
+        if failed:
+            # Switching now would leave the old copy of these users in the target.
+            shared_cache.set_setting("migration", migration)
+            print(f"[reembed] {len(failed)} live-updated ids failed to copy: {failed[:10]}; writes released, re-run to retry the switch", file=sys.stderr)
+            return 1
+        set_active_target(target)
+        # Releases held writes; they go to the new target.
+        shared_cache.set_setting("migration", {**migration, "flipped": True})
+        print(f"[reembed] reads and writes now go to {target_key(target)} ({target['embed_model']})")
+        # Keep writers reading the active target fresh until every worker's cached copy has expired.
+        time.sleep(ACTIVE_TARGET_TTL_S + 1)
+        leftover = shared_cache.take_dirty(args.page_size)
+        if leftover:
+            # Only possible for a write that gave up waiting just as the switch happened.
+            print(
+                f"[reembed] {len(leftover)} source writes arrived after the switch and were not copied "
+                f"(writes are held at most {MIGRATION_FREEZE_MAX_S:.0f}s): {leftover[:10]}",
+                file=sys.stderr,
+            )
+        shared_cache.set_setting("migration", None)
+        ckpt["phase"] = "done"
+        ckpt["finished_at"] = time.time()
+        _save_checkpoint(args.checkpoint, ckpt)
+
+    print(f"[reembed] done: {ckpt['copied']} vectors in {target_key(target)}")
+    return 0
+
+
+def main(argv: List[str] | None = None) -> int:
+    current = active_target()
+    p = argparse.ArgumentParser(description="Re-embed all users into a new index/namespace and switch reads to it.")
+    p.add_argument("--target-index", default=None, help="Destination index (default: the active one)")
+    p.add_argument("--target-namespace", default=None, help="Destination namespace (default: the active one)")
+    p.add_argument("--model", default=current["embed_model"], help="Embedding model for the new vectors")
+    p.add_argument("--input-type", default=current["embed_input_type"], help="Embedding input_type")
+    p.add_argument("--page-size", type=int, default=100, help="Ids listed and fetched per page")
+    p.add_argument("--embed-batch", type=int, default=96, help="Texts per embed call")
+    p.add_argument("--upsert-batch", type=int, default=100, help="Vectors per upsert call")
+    p.add_argument("--concurrency", type=int, default=4, help="Pages copied in parallel")
+    p.add_argument("--max-rps", type=float, default=50.0, help="Vectors embedded per second (0 = unlimited)")
+    p.add_argument("--checkpoint", default="/tmp/mingle_reembed.json", help="Checkpoint file used to resume")
+    p.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    return run(p.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
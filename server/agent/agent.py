@@ -1,24 +1,170 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import PromptTemplate
-from typing import List, Dict, Any
-from dotenv import load_dotenv
+from typing import List, Dict, Any, TYPE_CHECKING
 import os
 import json
-import re
+import threading
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI
 
 # ------------ Env & LLM ------------
-load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 # Use a more stable model
 LLM_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
+# Extra calls allowed when the model's JSON fails validation.
+LLM_MAX_REPAIRS = int(os.getenv("LLM_MAX_REPAIRS", "1"))
+
+# Built on first use so importing the app stays offline and fast.
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm() -> "ChatGoogleGenerativeAI":
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                _llm = ChatGoogleGenerativeAI(
+                    model=LLM_MODEL,
+                    temperature=0.1,  # Lower temperature for more consistent output
+                    max_output_tokens=2048,
+                    api_key=GOOGLE_API_KEY,
+                )
+    return _llm
+
+
+def warm_up_llm():
+    """
+    Build the client and open its connection with a token count, which
+    round-trips to Gemini without generating anything.
+    """
+    get_llm().get_num_tokens("warm up")
+
+
+# ------------ Structured output ------------
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {
+    "calls": 0,           # recommender requests
+    "llm_invocations": 0, # including repair attempts
+    "parse_failures": 0,  # responses that failed validation
+    "repairs": 0,         # repair attempts made
+    "repaired": 0,        # requests saved by a repair
+    "exhausted": 0,       # requests that ended with no valid output
+    "output_chars": 0,
+}
+
+
+def _count(name: str, n: int = 1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def llm_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out: Dict[str, Any] = dict(_stats)
+    calls = out["calls"] or 1
+    out["parse_failure_rate"] = round(out["parse_failures"] / max(out["llm_invocations"], 1), 4)
+    out["retry_rate"] = round(out["repairs"] / calls, 4)
+    return out
+
+
+def _recs_schema(n_candidates: int) -> Dict[str, Any]:
+    """
+    Gemini response schema: candidates are referred to by their list number,
+    constrained with an enum so the model can't pick anything outside the pool.
+    """
+    return {
+        "type_": "OBJECT",
+        "properties": {
+            "recommendations": {
+                "type_": "ARRAY",
+                "items": {
+                    "type_": "OBJECT",
+                    "properties": {
+                        "id": {"type_": "STRING", "format_": "enum", "enum": [str(i) for i in range(n_candidates)]},
+                        "score": {"type_": "INTEGER"},
+                        "reason": {"type_": "STRING"},
+                    },
+                    "required": ["id", "score", "reason"],
+                },
+            },
+        },
+        "required": ["recommendations"],
+    }
+
+
+def _validate_recs(txt: str, n_candidates: int) -> List[Dict[str, Any]]:
+    """
+    Parse and check the model's JSON. Raises ValueError describing the first
+    problem so it can be fed back to the model.
+    """
+    try:
+        obj = json.loads(txt)
+    except Exception as e:
+        raise ValueError(f"not valid JSON ({e})")
+    recs = obj.get("recommendations") if isinstance(obj, dict) else None
+    if not isinstance(recs, list):
+        raise ValueError('missing "recommendations" array')
+
+    out, seen = [], set()
+    for r in recs:
+        if not isinstance(r, dict):
+            raise ValueError("each recommendation must be an object")
+        try:
+            idx = int(str(r.get("id")).strip())
+        except Exception:
+            raise ValueError(f"id {r.get('id')!r} is not a candidate number")
+        if not 0 <= idx < n_candidates:
+            raise ValueError(f"id {idx} is out of range 0-{n_candidates - 1}")
+        try:
+            score = int(r.get("score", 0))
+        except Exception:
+            raise ValueError(f"score {r.get('score')!r} is not an integer")
+        if idx in seen:
+            continue
+        seen.add(idx)
+        out.append({"id": idx, "score": max(0, min(100, score)), "reason": (r.get("reason") or "").strip()})
+    return out
+
 
-llm = ChatGoogleGenerativeAI(
-    model=LLM_MODEL,
-    temperature=0.1,  # Lower temperature for more consistent output
-    max_output_tokens=2048,
-    api_key=GOOGLE_API_KEY,
-)
+def _invoke_structured(llm: "ChatGoogleGenerativeAI", prompt: str, n_candidates: int) -> List[Dict[str, Any]]:
+    generation_config = {
+        "response_mime_type": "application/json",
+        "response_schema": _recs_schema(n_candidates),
+    }
+    _count("calls")
+    attempt_prompt = prompt
+    last_error: ValueError | None = None
+    for attempt in range(LLM_MAX_REPAIRS + 1):
+        if attempt:
+            _count("repairs")
+        _count("llm_invocations")
+        result = llm.invoke(attempt_prompt, generation_config=generation_config)
+        raw = getattr(result, "content", result)  # ChatGoogleGenerativeAI returns an object with .content
+        raw = raw if isinstance(raw, str) else json.dumps(raw)
+        _count("output_chars", len(raw))
+        try:
+            recs = _validate_recs(raw, n_candidates)
+        except ValueError as e:
+            _count("parse_failures")
+            last_error = e
+            attempt_prompt = (
+                f"{prompt}\n\nYour previous reply was rejected: {e}.\n"
+                "Reply again with only the JSON object, using candidate numbers as ids."
+            )
+            continue
+        if attempt:
+            _count("repaired")
+        return recs
+    _count("exhausted")
+    # Fail loudly: an empty list would be stored and served as a real result.
+    raise ValueError(f"model output still invalid after {LLM_MAX_REPAIRS + 1} attempts: {last_error}")
+
+
+def _numbered(items: List[str]) -> str:
+    return "\n".join(f"[{i}] {x}" for i, x in enumerate(items))
 
 def recommend_names_from_pool(
     bio: str,
@@ -27,7 +173,7 @@ def recommend_names_from_pool(
     profile: str | None = None,
     prior_context: List[Dict[str, Any]] | None = None,
     top_k: int = 5,
-    llm: ChatGoogleGenerativeAI = llm,
+    llm: "ChatGoogleGenerativeAI | None" = None,
 ) -> List[Dict[str, Any]]:
     """
     Given a user's bio, a set of other people's bio snippets, and a candidate name pool,
@@ -35,6 +181,7 @@ def recommend_names_from_pool(
 
     Returns a list of dicts like:
       [{"name": "...","score": 0-100,"reason": "..."}]
+    Raises ValueError if the model's reply is still invalid after LLM_MAX_REPAIRS repairs.
     """
 
     # Guardrails / defaults
@@ -46,7 +193,7 @@ def recommend_names_from_pool(
     if not names:
         return []
 
-    # Prompt: keep it tight, constrain output, forbid inventing names
+    # Prompt: keep it tight; the response schema constrains the output shape
     template = """
         You are helping pick relevant people for a user to connect with.
 
@@ -62,28 +209,22 @@ def recommend_names_from_pool(
         OTHER PEOPLE'S BIOS (snippets):
         {snippets_block}
 
-        CANDIDATE NAMES (the only names you may choose from):
+        CANDIDATES (the only people you may choose from, by number):
         {names_block}
 
         TASK:
-        1) Select up to {top_k} names from the CANDIDATE NAMES that best match the USER BIO,
+        1) Select up to {top_k} candidates that best match the USER BIO,
         using the OTHER PEOPLE'S BIOS as evidence of fit (skills, interests, domain, goals).
         2) Assign a 0-100 relevance score (higher is better).
-        3) Briefly explain the reason for each pick (one sentence).
-        4) DO NOT invent names that are not in CANDIDATE NAMES.
-
-        STRICT OUTPUT (valid JSON only, no prose outside JSON):
-        {{
-        "recommendations": [
-            {{"name": "<name from candidate list>", "score": <int 0-100>, "reason": "<short reason>"}}
-        ]
-        }}
+        3) Briefly explain the reason for each pick (one short sentence).
+
+        OUTPUT: JSON {{"recommendations": [{{"id": "<candidate number>", "score": <int>, "reason": "<short reason>"}}]}}
     """
     prompt = PromptTemplate.from_template(template)
 
     # Build neat bullet blocks to help the model
     snippets_block = "\n".join(f"- {s}" for s in snippets) if snippets else "- (none provided)"
-    names_block = "\n".join(f"- {n}" for n in names)
+    names_block = _numbered(names)
 
     prior_ctx_block = "- (none)\n"
     if prior_context:
@@ -94,61 +235,23 @@ def recommend_names_from_pool(
 
     profile_block = (profile or "(none)")
 
+    k = min(max(top_k, 1), len(names))
     formatted = prompt.format(
         bio=bio,
         profile_block=profile_block,         
         prior_ctx_block=prior_ctx_block, 
         snippets_block=snippets_block,
         names_block=names_block,
-        top_k=min(max(top_k, 1), len(names)),
+        top_k=k,
     )
 
-    # Call LLM
-    result = llm.invoke(formatted)
-    raw = getattr(result, "content", result)  # ChatGoogleGenerativeAI returns an object with .content
+    # Call LLM (schema-constrained, validated, bounded repair)
+    recs = _invoke_structured(llm or get_llm(), formatted, len(names))
 
-    # Parse JSON robustly
-    def _parse_recs(txt: str) -> List[Dict[str, Any]]:
-        # Try direct JSON
-        try:
-            obj = json.loads(txt)
-            recs = obj.get("recommendations", [])
-            if isinstance(recs, list):
-                return recs
-        except Exception:
-            pass
-        # Try to extract the first JSON object
-        m = re.search(r"\{.*\}", txt, flags=re.DOTALL)
-        if m:
-            try:
-                obj = json.loads(m.group(0))
-                recs = obj.get("recommendations", [])
-                if isinstance(recs, list):
-                    return recs
-            except Exception:
-                pass
-        return []
-
-    recs = _parse_recs(raw)
-
-    # Post-validate: keep only candidates that are in the provided pool; coerce fields
-    name_set = {n.lower(): n for n in names}
-    cleaned = []
-    for r in recs:
-        n = (r.get("name") or "").strip()
-        if n.lower() in name_set:
-            try:
-                score = int(r.get("score", 0))
-            except Exception:
-                score = 0
-            reason = (r.get("reason") or "").strip()
-            cleaned.append({"name": name_set[n.lower()], "score": max(0, min(100, score)), "reason": reason})
-
-    # If model returns more than top_k, trim; also sort by score desc
+    # Map ids back to names; sort by score desc and trim to top_k
+    cleaned = [{"name": names[r["id"]], "score": r["score"], "reason": r["reason"]} for r in recs]
     cleaned.sort(key=lambda x: x.get("score", 0), reverse=True)
-    cleaned = cleaned[: min(max(top_k, 1), len(names))]
-
-    return cleaned
+    return cleaned[:k]
 
 def reccomend_events_from_pool(
     bio: str,
@@ -158,7 +261,7 @@ def reccomend_events_from_pool(
     events: List[str],
     prior_context: List[Dict[str, Any]] | None = None,
     top_k: int = 5,
-    llm: ChatGoogleGenerativeAI = llm,
+    llm: "ChatGoogleGenerativeAI | None" = None,
 ) -> List[Dict[str, Any]]:
     bio = (bio or "").strip()
     location = (location or "").strip()
@@ -168,7 +271,7 @@ def reccomend_events_from_pool(
     prior_context = prior_context or []
     if not events:
         return []
-    # Prompt: keep it tight, constrain output, forbid inventing events
+    # Prompt: keep it tight; the response schema constrains the output shape
     template = """
         You are helping pick relevant events for a user to attend.
         USER BIO:
@@ -184,32 +287,28 @@ def reccomend_events_from_pool(
         {prior_ctx_block}
         ALL EVENTS (snippets):
         {snippets_block}
-        EVENTS NAMES (the only events you may choose from):
+        EVENTS (the only events you may choose from, by number):
         {events_block}
 
         TASK:
-        1) Select up to {top_k} events from the EVENTS NAMES that best match the USER BIO USER LOCATION and USER INTERESTS,
+        1) Select up to {top_k} events that best match the USER BIO USER LOCATION and USER INTERESTS,
         using the ALL EVENTS as evidence of fit (topics, speakers, goals).
         2) Assign a 0-100 relevance score (higher is better).
-        3) Briefly explain the reason for each pick (one sentence).
-        4) DO NOT invent events that are not in EVENTS NAMES.
-        STRICT OUTPUT (valid JSON only, no prose outside JSON):
-        {{
-        "recommendations": [
-            {{"event": "<event from event list>", "score": <int 0-100>, "reason": "<short reason>"}}
-        ]
-        }}
+        3) Briefly explain the reason for each pick (one short sentence).
+
+        OUTPUT: JSON {{"recommendations": [{{"id": "<event number>", "score": <int>, "reason": "<short reason>"}}]}}
     """
     prompt = PromptTemplate.from_template(template)
     interests_block = "\n".join(f"- {i}" for i in interests) if interests else "- (none provided)"
     snippets_block = "\n".join(f"- {s}" for s in snippets) if snippets else "- (none provided)"
-    events_block = "\n".join(f"- {e}" for e in events)
+    events_block = _numbered(events)
     prior_ctx_block = "- (none)\n"
     if prior_context:
         prior_ctx_block = "\n".join(
-            f'- event="{c.get("event","")}", reason="{c.get("reason","")}", score={c.get("score",0)}'
+            f'- event="{c.get("name", c.get("event",""))}", reason="{c.get("reason","")}", score={c.get("score",0)}'
             for c in prior_context[:30]  # cap to keep prompt small
         ) or "- (none)"
+    k = min(max(top_k, 1), len(events))
     formatted = prompt.format(
         bio=bio,
         location=location or "(none)",
@@ -217,41 +316,9 @@ def reccomend_events_from_pool(
         prior_ctx_block=prior_ctx_block,
         snippets_block=snippets_block,
         events_block=events_block,
-        top_k=min(max(top_k, 1), len(events)),
+        top_k=k,
     )
-    result = llm.invoke(formatted)
-    raw = getattr(result, "content", result)  # ChatGoogleGenerativeAI returns
-
-    def _parse_recs(txt: str) -> List[Dict[str, Any]]:
-        try:
-            obj = json.loads(txt)
-            recs = obj.get("recommendations", [])
-            if isinstance(recs, list):
-                return recs
-        except Exception:
-            pass
-        m = re.search(r"\{.*\}", txt, flags=re.DOTALL)
-        if m:
-            try:
-                obj = json.loads(m.group(0))
-                recs = obj.get("recommendations", [])
-                if isinstance(recs, list):
-                    return recs
-            except Exception:
-                pass
-        return []
-    recs = _parse_recs(raw)
-    event_set = {e.lower(): e for e in events}
-    cleaned = []
-    for r in recs:
-        e = (r.get("event") or "").strip()
-        if e.lower() in event_set:
-            try:
-                score = int(r.get("score", 0))
-            except Exception:
-                score = 0
-            reason = (r.get("reason") or "").strip()
-            cleaned.append({"event": event_set[e.lower()], "score": max(0, min(100, score)), "reason": reason})
+    recs = _invoke_structured(llm or get_llm(), formatted, len(events))
+    cleaned = [{"event": events[r["id"]], "score": r["score"], "reason": r["reason"]} for r in recs]
     cleaned.sort(key=lambda x: x.get("score", 0), reverse=True)
-    cleaned = cleaned[: min(max(top_k, 1), len(events))]
-    return cleaned
+    return cleaned[:k]
@@ -0,0 +1,15 @@
+import os
+
+# Preforked uvicorn workers. The app is imported once in the master and
+# shared copy-on-write; network clients and sqlite handles are created lazily
+# inside each worker, so nothing is opened before the fork.
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# cpu_count() reports the host's cores, not the container's CPU quota, so
+# default low and let the deployment size it with WEB_CONCURRENCY.
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
@@ -1,9 +1,7 @@
 from fastapi import Depends, HTTPException, status
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer
-from dotenv import load_dotenv
 import os
-load_dotenv()
 
 TOKEN_SECRET = os.getenv("TOKEN_SECRET")  # 👈 use the SAME var as Next.js
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
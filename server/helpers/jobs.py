@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import traceback
+from typing import Any, Callable, Dict
+
+RECS_WORKERS = int(os.getenv("RECS_WORKERS", "2"))
+
+# Small, separate pool so background refreshes never take request threads.
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_inflight: set[str] = set()
+_inflight_lock = threading.Lock()
+_timers: Dict[str, threading.Timer] = {}
+_stats: Dict[str, int] = {"submitted": 0, "deduped": 0, "debounced": 0, "succeeded": 0, "failed": 0}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=RECS_WORKERS, thread_name_prefix="recs")
+    return _executor
+
+
+def _invoke(key: str, fn: Callable[..., Any], args: tuple, kwargs: dict):
+    try:
+        fn(*args, **kwargs)
+        with _inflight_lock:
+            _stats["succeeded"] += 1
+    except Exception as e:
+        print(f"[jobs] {key} failed: {repr(e)}")
+        traceback.print_exc()
+        with _inflight_lock:
+            _stats["failed"] += 1
+
+
+def _run(key: str, fn: Callable[..., Any], args: tuple, kwargs: dict):
+    try:
+        _invoke(key, fn, args, kwargs)
+    finally:
+        with _inflight_lock:
+            _inflight.discard(key)
+
+
+def submit(key: str, fn: Callable[..., Any], *args, **kwargs) -> bool:
+    """
+    Queue fn in the background unless a job with the same key is already
+    queued or running. Returns True when a new job was queued.
+    """
+    with _inflight_lock:
+        if key in _inflight:
+            _stats["deduped"] += 1
+            return False
+        _inflight.add(key)
+        _stats["submitted"] += 1
+    _get_executor().submit(_run, key, fn, args, kwargs)
+    return True
+
+
+def _fire(key: str, fn: Callable[..., Any], args: tuple, kwargs: dict):
+    with _inflight_lock:
+        # Replaced or flushed while this timer was starting; the newer call owns the key.
+        if _timers.get(key) is not threading.current_thread():
+            return
+        del _timers[key]
+    _invoke(key, fn, args, kwargs)
+
+
+def debounce(key: str, delay_s: float, fn: Callable[..., Any], *args, **kwargs):
+    """
+    Run fn delay_s seconds after the most recent call with this key. A call
+    that arrives while one is pending replaces it, so only the last one runs.
+    Pending calls are run, not dropped, by shutdown().
+    """
+    with _inflight_lock:
+        pending = _timers.pop(key, None)
+        if pending is not None:
+            pending.cancel()
+            _stats["debounced"] += 1
+        t = threading.Timer(delay_s, _fire, args=(key, fn, args, kwargs))
+        t.daemon = True
+        t.name = f"debounce:{key}"
+        _timers[key] = t
+        t.start()
+
+
+def job_stats() -> Dict[str, int]:
+    with _inflight_lock:
+        return {**_stats, "inflight": len(_inflight), "pending_debounced": len(_timers)}
+
+
+def flush_debounced():
+    """
+    Run every pending debounced call now instead of waiting out its delay.
+    """
+    with _inflight_lock:
+        pending = list(_timers.items())
+        _timers.clear()
+    for key, t in pending:
+        t.cancel()
+        _, fn, args, kwargs = t.args
+        _invoke(key, fn, args, kwargs)
+
+
+def shutdown(wait: bool = False):
+    global _executor
+    # A debounced write that is still waiting would otherwise be lost with the process.
+    flush_debounced()
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Any, List, Tuple
+
+# Failed steps are retried with doubling delays up to this cap until they succeed.
+WARMUP_RETRY_MAX_S = float(os.getenv("WARMUP_RETRY_MAX_S", "60"))
+WARMUP_RETRY_BASE_S = 1.0
+
+# Readiness state shared by the lifespan hook and the /ready endpoint.
+_state: Dict[str, Any] = {
+    "started": False,
+    "ready": False,
+    "steps": {},
+    "attempts": 0,
+    "duration_ms": None,
+}
+_state_lock = threading.Lock()
+
+
+def _run(steps: List[Tuple[str, Callable[[], Any]]]):
+    t0 = time.monotonic()
+    pending = list(steps)
+    delay = WARMUP_RETRY_BASE_S
+    while True:
+        with _state_lock:
+            _state["attempts"] += 1
+        failed = []
+        for name, fn in pending:
+            try:
+                fn()
+                result = "ok"
+            except Exception as e:
+                # A failed step shouldn't kill the process; /ready reports it and it is retried.
+                print(f"[warmup] {name} failed: {repr(e)}")
+                traceback.print_exc()
+                result = f"error: {e}"
+                failed.append((name, fn))
+            with _state_lock:
+                _state["steps"][name] = result
+        if not failed:
+            break
+        pending = failed
+        time.sleep(delay)
+        delay = min(delay * 2, WARMUP_RETRY_MAX_S)
+    with _state_lock:
+        _state["ready"] = True
+        _state["duration_ms"] = int((time.monotonic() - t0) * 1000)
+
+
+def start_warmup(steps: List[Tuple[str, Callable[[], Any]]]) -> threading.Thread | None:
+    """
+    Run the warm-up steps in a daemon thread so the server can answer /ping
+    while the network clients are being built. Steps that fail (say, a
+    transient error at boot) are retried with backoff until they pass.
+    """
+    with _state_lock:
+        if _state["started"]:
+            return None
+        _state["started"] = True
+    t = threading.Thread(target=_run, args=(steps,), name="warmup", daemon=True)
+    t.start()
+    return t
+
+
+def warmup_status() -> Dict[str, Any]:
+    with _state_lock:
+        return {
+            "ready": _state["ready"],
+            "steps": dict(_state["steps"]),
+            "attempts": _state["attempts"],
+            "duration_ms": _state["duration_ms"],
+        }
@@ -1,8 +1,21 @@
 from typing import List, Dict, Any
+from contextlib import asynccontextmanager
+import hashlib
+import json
+import time
 import traceback
+import anyio.to_thread
 from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+# Load .env before importing app modules; several read their settings at import time.
+load_dotenv()
+
 from helpers.extractToken import get_current_user
+from helpers.warmup import start_warmup, warmup_status
+from helpers.jobs import submit as submit_job, job_stats, shutdown as shutdown_jobs
 from model.pinecone import (
     add_user_pinecone,
     append_interest_context,
@@ -12,17 +25,25 @@ from model.pinecone import (
     user_exists,
     fetch_user_vector,
     set_user_bio,
-    upsert_user_with_bio_reembed,
-    index
+    update_user_bio,
+    normalize_bio,
+    warm_up_pinecone,
+    pinecone_transport_stats,
 )
-from agent.agent import recommend_names_from_pool, reccomend_events_from_pool
+from model.transport import THREADPOOL_SIZE
+from model.rec_store import get_recs, list_recs, put_recs
+from model.shared_cache import try_lease, release_lease, cache_stats
+from agent.agent import recommend_names_from_pool, reccomend_events_from_pool, warm_up_llm, llm_stats
 from pydantic import BaseModel, Field
 from enum import Enum
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
 NEXT_PUBLIC_APP_URL = os.getenv("NEXT_PUBLIC_APP_URL", "http://localhost:3000")
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+# Materialized recommendations older than this are served stale and refreshed in the background.
+RECS_TTL_S = float(os.getenv("RECS_TTL_S", "3600"))
+# How long one worker holds the right to recompute a result before another may retry.
+RECS_LEASE_S = float(os.getenv("RECS_LEASE_S", "120"))
 
 class InterestType(str, Enum):
     networking = "Networking"
@@ -59,6 +80,9 @@ class RecommendationsOut(BaseModel):
     updated_bio_now: bool = False
     has_bio_after: bool
     recommendations: List[RecommendationItem] = Field(default_factory=list)
+    version: int | None = None
+    cached: bool = False
+    stale: bool = False
 
 class RecommendationsEvent(BaseModel):
     bio: str | None = None
@@ -70,7 +94,21 @@ class RecommendationsEvent(BaseModel):
 
 
 # ---------- App ----------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync routes run on this pool; keep it in step with the Pinecone connection pool.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # Warm clients in the background; /ping answers immediately, /ready flips when done.
+    if WARMUP_ON_STARTUP:
+        start_warmup([
+            ("pinecone", warm_up_pinecone),
+            ("llm", warm_up_llm),
+        ])
+    yield
+    shutdown_jobs(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "http://localhost:3000",
     NEXT_PUBLIC_APP_URL,
@@ -90,8 +128,16 @@ def read_root():
 
 @app.api_route("/ping", methods=["GET", "HEAD"])
 def ping(request: Request):
+    # Liveness only: never touches Pinecone or Gemini.
     return {"status": "alive"}
 
+@app.api_route("/ready", methods=["GET", "HEAD"])
+def ready(request: Request):
+    status = warmup_status()
+    if not WARMUP_ON_STARTUP:
+        status["ready"] = True
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @app.get("/me")
 def get_me(current_user: dict = Depends(get_current_user)):
     return {
@@ -99,24 +145,243 @@ def get_me(current_user: dict = Depends(get_current_user)):
         "username": current_user["username"]
     }
 
+@app.get("/stats/pinecone")
+def get_pinecone_stats(current_user: dict = Depends(get_current_user)):
+    return pinecone_transport_stats()
+
+@app.get("/stats/recs")
+def get_recs_stats(current_user: dict = Depends(get_current_user)):
+    return job_stats()
+
+@app.get("/stats/llm")
+def get_llm_stats(current_user: dict = Depends(get_current_user)):
+    return llm_stats()
+
+@app.get("/stats/cache")
+def get_cache_stats(current_user: dict = Depends(get_current_user)):
+    return cache_stats()
+
 @app.post("/register_pinecone_user")
 def register_user_in_pinecone(current_user: dict = Depends(get_current_user)):
     user_id = current_user["user_id"]
     username = current_user["username"]
-    default_text = f"This is the profile for {username}"
-    add_user_pinecone(user_id=user_id, username=username, text=default_text)
+    add_user_pinecone(user_id=user_id, username=username)
     return {"message": f"User {username} registered in Pinecone with ID {user_id}"}
 
 @app.get("/check_user_exists")
 def check_user_exists(current_user: dict = Depends(get_current_user)):
     user_id = current_user["user_id"]
     try:
-        response = index.fetch(ids=[user_id])
-        exists = user_id in response.vectors
-        return {"exists": exists}
+        return {"exists": user_exists(user_id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------- Shared helpers ----------
+def _sync_user_bio(user_id: str, username: str | None, bio: str) -> tuple[bool, bool, bool, str]:
+    """
+    Make sure the user exists in Pinecone and the stored bio matches the incoming one.
+    Returns (created, added_bio_now, updated_bio_now, final_bio).
+    """
+    created = False
+    if not user_exists(user_id):
+        add_user_pinecone(
+            user_id=user_id,
+            username=username,
+            bio=bio or None,
+        )
+        created = True
+
+    vec = fetch_user_vector(user_id)
+    existing_meta = dict(getattr(vec, "metadata", None) or {}) if vec else {}
+    existing_bio = (existing_meta.get("bio") or "").strip()
+
+    added_bio_now = False
+    updated_bio_now = False
+    if bio:
+        # Metadata-only when just formatting changed; content changes re-embed (debounced)
+        change = update_user_bio(user_id=user_id, bio=bio, existing_metadata=existing_meta)
+        if change != "unchanged":
+            added_bio_now = not existing_bio
+            updated_bio_now = bool(existing_bio)
+
+    # ✅ Always re-fetch the latest vector metadata from Pinecone
+    updated_vec = fetch_user_vector(user_id)
+    stored_bio = ""
+    if updated_vec and getattr(updated_vec, "metadata", None):
+        stored_bio = (updated_vec.metadata.get("bio") or "").strip()
+
+    # Use the canonical stored bio; fall back to incoming if for some reason it isn’t there
+    return created, added_bio_now, updated_bio_now, (stored_bio or bio)
+
+
+def _inputs_hash(inputs: Dict[str, Any]) -> str:
+    blob = json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _compute_people_recs(user_id: str, inputs: Dict[str, Any]) -> tuple[int | None, List[RecommendationItem]]:
+    interest = inputs["interest"]
+    prior_ctx = get_interest_context(user_id, interest)
+
+    recs_raw = recommend_names_from_pool(
+        bio=inputs["bio"],
+        snippets=inputs["snippets"],
+        names=inputs["names"],
+        profile=inputs["profile"],
+        prior_context=prior_ctx,
+        top_k=inputs["top_k"],
+    )
+    # Coerce to pydantic schema (validates and trims)
+    recs_items = [RecommendationItem(**r) for r in recs_raw]
+
+    try:
+        append_interest_context(
+            user_id=user_id,
+            interest=interest,
+            new_items=[r.model_dump() for r in recs_items],  # includes name/reason/score
+            max_items=100,  # tune as needed
+        )
+    except Exception:
+        pass
+
+    return _store_recs(user_id, "people", interest, inputs, recs_items), recs_items
+
+
+def _compute_event_recs(user_id: str, inputs: Dict[str, Any]) -> tuple[int | None, List[RecommendationItem]]:
+    # ---- Prior event context (for diversity / continuity)
+    prior_ctx = get_event_context(user_id)
+
+    recs_raw: List[Dict[str, Any]] = reccomend_events_from_pool(
+        bio=inputs["bio"],
+        location=inputs["location"],
+        interests=inputs["interests"],
+        snippets=inputs["snippets"],
+        events=inputs["events"],
+        prior_context=prior_ctx,
+        top_k=inputs["top_k"],
+    )
+
+    # recs_raw elements look like {"event": "...", "score": int, "reason": "..."}
+    # Map -> RecommendationItem(name=..., score=..., reason=...)
+    recs_items: List[RecommendationItem] = []
+    for r in recs_raw:
+        ev = (r.get("event") or "").strip()
+        if not ev:
+            continue
+        score = int(r.get("score", 0))
+        reason = (r.get("reason") or "").strip()
+        recs_items.append(RecommendationItem(name=ev, score=score, reason=reason))
+
+    # Persist context (uses "name" key as expected by your append_event_context)
+    try:
+        append_event_context(
+            user_id=user_id,
+            new_items=[ri.model_dump() for ri in recs_items],
+            max_items=100,
+        )
+    except Exception:
+        # Non-fatal: recommendations should still return
+        pass
+
+    return _store_recs(user_id, "events", "", inputs, recs_items), recs_items
+
+
+_COMPUTE = {
+    "people": _compute_people_recs,
+    "events": _compute_event_recs,
+}
+
+
+def _store_recs(user_id: str, kind: str, scope: str, inputs: Dict[str, Any], items: List[RecommendationItem]) -> int | None:
+    if not items:
+        # Nothing worth serving for RECS_TTL_S; the next request recomputes.
+        return None
+    try:
+        return put_recs(user_id, kind, scope, _inputs_hash(inputs), inputs, [i.model_dump() for i in items])
+    except Exception as e:
+        # The store is an optimization; a write failure must not fail the request.
+        print(f"[recs] store write failed for {kind}/{user_id}: {repr(e)}")
+        return None
+
+
+def _refresh_recs(key: str, kind: str, user_id: str, inputs: Dict[str, Any]):
+    try:
+        _COMPUTE[kind](user_id, inputs)
+    finally:
+        try:
+            release_lease(key)
+        except Exception:
+            pass
+
+
+def _schedule_refresh(kind: str, user_id: str, scope: str, inputs: Dict[str, Any]) -> bool:
+    key = f"{kind}:{user_id}:{scope}"
+    # Only one worker on the box recomputes a given result at a time.
+    try:
+        if not try_lease(key, RECS_LEASE_S):
+            return False
+    except Exception:
+        pass
+    return submit_job(key, _refresh_recs, key, kind, user_id, inputs)
+
+
+def _refresh_after_bio_change(user_id: str, bio: str, skip: tuple[str, str]):
+    """
+    Recompute every other materialized result this user has, using the pools
+    they last asked about and the new bio.
+    """
+    try:
+        entries = list_recs(user_id)
+    except Exception:
+        return
+    for entry in entries:
+        if (entry["kind"], entry["scope"]) == skip or entry["kind"] not in _COMPUTE:
+            continue
+        if entry["inputs"].get("bio") == normalize_bio(bio):
+            continue
+        inputs = {**entry["inputs"], "bio": normalize_bio(bio)}
+        _schedule_refresh(entry["kind"], user_id, entry["scope"], inputs)
+
+
+def _materialized_recs(
+    kind: str,
+    user_id: str,
+    scope: str,
+    inputs: Dict[str, Any],
+    pool: List[str],
+) -> tuple[List[RecommendationItem], int | None, bool, bool]:
+    """
+    Stale-while-revalidate lookup. Returns (items, version, cached, stale).
+    A fresh entry is served as is; a stale one is served (restricted to the
+    current pool) while a background refresh runs; a miss, or an entry built
+    from a different bio, computes inline.
+    """
+    try:
+        entry = get_recs(user_id, kind, scope)
+    except Exception as e:
+        print(f"[recs] store read failed for {kind}/{user_id}: {repr(e)}")
+        entry = None
+
+    if entry:
+        same_inputs = entry["input_hash"] == _inputs_hash(inputs)
+        young = (time.time() - entry["computed_at"]) < RECS_TTL_S
+        pool_set = {p.lower() for p in pool}
+        items = [
+            RecommendationItem(**r)
+            for r in entry["payload"]
+            if (r.get("name") or "").lower() in pool_set
+        ][: inputs["top_k"]]
+        if same_inputs and young:
+            return items, entry["version"], True, False
+        # After a bio edit the old result is about someone else; don't serve it, even as stale.
+        if items and entry["inputs"].get("bio") == inputs["bio"]:
+            _schedule_refresh(kind, user_id, scope, inputs)
+            return items, entry["version"], True, True
+
+    version, items = _COMPUTE[kind](user_id, inputs)
+    return items, version, False, False
+
+
 # ---------- The wired endpoint ----------
 @app.post("/recommendations", response_model=RecommendationsOut)
 def get_recommendations(
@@ -142,82 +407,41 @@ def get_recommendations(
         snippets = []
 
     # Pinecone bookkeeping (create user, attach or update bio)
-    if not user_exists(user_id):
-        add_user_pinecone(
-            user_id=user_id,
-            username=username,
-            text=f"This is the profile for {username}",
-            bio=bio if bio else None
-        )
-        created = True
-    else:
-        created = False
-
-    vec = fetch_user_vector(user_id)
-    existing_bio = ""
-    if vec and getattr(vec, "metadata", None):
-        existing_bio = (vec.metadata.get("bio") or "").strip()
-
-    added_bio_now = False  # keep your existing flag semantics
-
-    # --- Add or update logic
-    if bio:
-        # If there's no stored bio, add it; if it's different, update it.
-        if not existing_bio:
-            upsert_user_with_bio_reembed(user_id=user_id, username=username, bio=bio)
-            added_bio_now = True
-        elif bio != existing_bio:
-            # Update (re-embed only when content actually changed)
-            upsert_user_with_bio_reembed(user_id=user_id, username=username, bio=bio)
-
-    # ✅ Always re-fetch the latest vector metadata from Pinecone
-    updated_vec = fetch_user_vector(user_id)
-    stored_bio = ""
-    if updated_vec and getattr(updated_vec, "metadata", None):
-        stored_bio = (updated_vec.metadata.get("bio") or "").strip()
-
-    # Use the canonical stored bio; fall back to incoming if for some reason it isn’t there
-    final_bio = stored_bio or bio
+    created, added_bio_now, updated_bio_now, final_bio = _sync_user_bio(user_id, username, bio)
 
     # has_bio_after reflects canonical value
     has_bio_after = bool(final_bio)
 
+    if added_bio_now or updated_bio_now:
+        _refresh_after_bio_change(user_id, final_bio, skip=("people", interest.value))
 
-    prior_ctx = get_interest_context(user_id, interest.value)
-    
-    # ---- Call the LLM recommender ----
+    inputs = {
+        "bio": normalize_bio(final_bio),
+        "snippets": snippets,
+        "names": names,
+        "profile": profile,
+        "interest": interest.value,
+        "top_k": min(top_k, len(names)),
+    }
+
+    # ---- Serve the materialized result or call the LLM recommender ----
     try:
-        recs_raw = recommend_names_from_pool(
-            bio=final_bio,
-            snippets=snippets,
-            names=names,
-            profile=profile,
-            prior_context=prior_ctx,
-            top_k=min(top_k, len(names)),
-        )
-        # Coerce to pydantic schema (validates and trims)
-        recs_items = [RecommendationItem(**r) for r in recs_raw]
+        recs_items, version, cached, stale = _materialized_recs("people", user_id, interest.value, inputs, names)
     except Exception as e:
         # Surface a clean error; you can log full details server-side
         raise HTTPException(status_code=500, detail=f"Failed to generate recommendations: {e}")
-    
-    try:
-        append_interest_context(
-            user_id=user_id,
-            interest=interest.value,
-            new_items=[r.model_dump() for r in recs_items],  # includes name/reason/score
-            max_items=100,  # tune as needed
-        )
-    except Exception:
-        pass
 
     return RecommendationsOut(
         ok=True,
         user_id=user_id,
         created_user=created,
         added_bio_now=added_bio_now,
+        updated_bio_now=updated_bio_now,
         has_bio_after=has_bio_after,
         recommendations=recs_items,
+        version=version,
+        cached=cached,
+        stale=stale,
     )
 
 
@@ -249,87 +473,38 @@ def get_event_recommendations(
 
     # ---- Pinecone bookkeeping
     try:
-        created = False
-        if not user_exists(user_id):
-            add_user_pinecone(
-                user_id=user_id,
-                username=username,
-                text=f"This is the profile for {username}",
-                bio=bio or None,
-            )
-            created = True
-
-        vec = fetch_user_vector(user_id)
-        existing_bio = ""
-        if vec and getattr(vec, "metadata", None):
-            existing_bio = (vec.metadata.get("bio") or "").strip()
-
-        added_bio_now = False
-        if bio:
-            if not existing_bio:
-                upsert_user_with_bio_reembed(user_id=user_id, username=username, bio=bio)
-                added_bio_now = True
-            elif bio != existing_bio:
-                upsert_user_with_bio_reembed(user_id=user_id, username=username, bio=bio)
-
-        # Re-fetch canonical stored bio
-        updated_vec = fetch_user_vector(user_id)
-        stored_bio = ""
-        if updated_vec and getattr(updated_vec, "metadata", None):
-            stored_bio = (updated_vec.metadata.get("bio") or "").strip()
-        final_bio = stored_bio or bio
+        created, added_bio_now, updated_bio_now, final_bio = _sync_user_bio(user_id, username, bio)
         has_bio_after = bool(final_bio)
-
-        # ---- Prior event context (for diversity / continuity)
-        prior_ctx = get_event_context(user_id)
-
     except Exception as e:
         _http_500("Pinecone user setup failed", e)
 
-    # ---- Call LLM & normalize to RecommendationItem
+    if added_bio_now or updated_bio_now:
+        _refresh_after_bio_change(user_id, final_bio, skip=("events", ""))
+
+    inputs = {
+        "bio": normalize_bio(final_bio),
+        "location": location,
+        "interests": interests,
+        "snippets": snippets,
+        "events": events,
+        "top_k": min(top_k, len(events)),
+    }
+
+    # ---- Serve the materialized result or call the LLM
     try:
-        recs_raw: List[Dict[str, Any]] = reccomend_events_from_pool(
-            bio=final_bio,
-            location=location,
-            interests=interests,
-            snippets=snippets,
-            events=events,
-            prior_context=prior_ctx,
-            top_k=min(top_k, len(events)),
-        )
+        recs_items, version, cached, stale = _materialized_recs("events", user_id, "", inputs, events)
     except Exception as e:
         _http_500("Event LLM failed", e)
 
-    try:
-        # recs_raw elements look like {"event": "...", "score": int, "reason": "..."}
-        # Map -> RecommendationItem(name=..., score=..., reason=...)
-        recs_items: List[RecommendationItem] = []
-        for r in recs_raw:
-            ev = (r.get("event") or "").strip()
-            if not ev:
-                continue
-            score = int(r.get("score", 0))
-            reason = (r.get("reason") or "").strip()
-            recs_items.append(RecommendationItem(name=ev, score=score, reason=reason))
-
-        # Persist context (uses "name" key as expected by your append_event_context)
-        try:
-            append_event_context(
-                user_id=user_id,
-                new_items=[ri.model_dump() for ri in recs_items],
-                max_items=100,
-            )
-        except Exception:
-            # Non-fatal: recommendations should still return
-            pass
-
-        return RecommendationsOut(
-            ok=True,
-            user_id=user_id,
-            created_user=created,
-            added_bio_now=added_bio_now,
-            has_bio_after=has_bio_after,
-            recommendations=recs_items,
-        )
-    except Exception as e:
-        _http_500("Mapping recommendations failed", e)
\ No newline at end of file
+    return RecommendationsOut(
+        ok=True,
+        user_id=user_id,
+        created_user=created,
+        added_bio_now=added_bio_now,
+        updated_bio_now=updated_bio_now,
+        has_bio_after=has_bio_after,
+        recommendations=recs_items,
+        version=version,
+        cached=cached,
+        stale=stale,
+    )
@@ -1,71 +1,398 @@
-from pinecone import Pinecone
-from dotenv import load_dotenv
 import os
 import json
+import hashlib
+import threading
+import time
 from datetime import datetime, timezone
-
-load_dotenv()
+from types import SimpleNamespace
+from model import transport
+from model import shared_cache
+from helpers.jobs import debounce
 
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
+PINECONE_NAMESPACE = os.getenv("PINECONE_NAMESPACE", "")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "llama-text-embed-v2")
+EMBED_INPUT_TYPE = os.getenv("EMBED_INPUT_TYPE", "query")
+# How often each worker re-reads the active target, so a migration flip reaches all of them.
+ACTIVE_TARGET_TTL_S = float(os.getenv("ACTIVE_TARGET_TTL_S", "5"))
+# Longest a write waits for a migration's flip before going ahead anyway
+# (a crashed migration must not block writes for good).
+MIGRATION_FREEZE_MAX_S = float(os.getenv("MIGRATION_FREEZE_MAX_S", "60"))
+# Quiet period after the last bio edit before the new bio is embedded.
+BIO_EMBED_DEBOUNCE_S = float(os.getenv("BIO_EMBED_DEBOUNCE_S", "3"))
+
+# Clients are built on first use so importing this module never touches the network.
+_pc = None
+_indexes: dict = {}
+_dimensions: dict[str, int] = {}
+if os.getenv("PINECONE_DIMENSION"):
+    _dimensions[PINECONE_INDEX_NAME or ""] = int(os.getenv("PINECONE_DIMENSION"))
+_client_lock = threading.Lock()
+_target: dict | None = None
+_target_read_at = 0.0
+
+_NAMESPACED_OPS = {"fetch", "upsert", "update", "list_paginated"}
+
+
+def get_pinecone():
+    global _pc
+    if _pc is None:
+        with _client_lock:
+            if _pc is None:
+                _pc = transport.build_client(PINECONE_API_KEY)
+    return _pc
+
+
+def default_target() -> dict:
+    return {
+        "index": PINECONE_INDEX_NAME,
+        "namespace": PINECONE_NAMESPACE,
+        "embed_model": EMBED_MODEL,
+        "embed_input_type": EMBED_INPUT_TYPE,
+    }
+
+
+def target_key(target: dict) -> str:
+    return f"{target['index']}/{target['namespace']}"
+
+
+def active_target(fresh: bool = False) -> dict:
+    """
+    Where reads and writes go: index, namespace and the embedding model that
+    built its vectors. Env vars are the default; a finished re-embed migration
+    overrides them through the shared cache.
+    """
+    global _target, _target_read_at
+    now = time.monotonic()
+    if fresh or _target is None or now - _target_read_at > ACTIVE_TARGET_TTL_S:
+        try:
+            stored = shared_cache.get_setting("active_target")
+        except Exception:
+            stored = None
+        _target = {**default_target(), **(stored or {})}
+        _target_read_at = now
+    return _target
+
+
+def write_target() -> dict:
+    """
+    Where a write goes right now. While a migration runs the active target is
+    read fresh rather than from the per-worker cache, and writes wait while
+    the migration holds them for its flip, so none lands in the old target
+    after its last changes were copied.
+    """
+    try:
+        migration = shared_cache.migration_state()
+    except Exception:
+        migration = None
+    if not migration:
+        return active_target()
+    # The cap runs from when the migration first held writes, not from when this writer arrived.
+    while migration and migration.get("frozen"):
+        if time.time() - migration.get("frozen_at", 0) > MIGRATION_FREEZE_MAX_S:
+            print("[reembed] migration has held writes too long; writing anyway")
+            break
+        time.sleep(0.2)
+        migration = shared_cache.migration_state(fresh=True)
+    return active_target(fresh=True)
+
+
+def same_target(a: dict, b: dict) -> bool:
+    return (target_key(a), a["embed_model"], a["embed_input_type"]) == (
+        target_key(b), b["embed_model"], b["embed_input_type"]
+    )
+
+
+def set_active_target(target: dict):
+    global _target
+    shared_cache.set_setting("active_target", target)
+    shared_cache.clear_user_vectors()
+    _target = None
+
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(PINECONE_INDEX_NAME)
+def get_index(name: str | None = None):
+    name = name or active_target()["index"]
+    idx = _indexes.get(name)
+    if idx is None:
+        pc = get_pinecone()
+        with _client_lock:
+            idx = _indexes.get(name)
+            if idx is None:
+                idx = _indexes[name] = transport.build_index(pc, name)
+    return idx
 
 
-def _embed_text(text: str) -> list[float]:
-    resp = pc.inference.embed(
-        model="llama-text-embed-v2",
-        inputs=[text],
-        parameters={"input_type": "query"},
+def index_call(op: str, target: dict | None = None, **kwargs):
+    # Every data-plane call gets the per-call timeout and jittered retries.
+    target = target or active_target()
+    if op in _NAMESPACED_OPS:
+        kwargs.setdefault("namespace", target["namespace"])
+    fn = getattr(get_index(target["index"]), op)
+    return transport.call(op, fn, **transport.timeout_kwargs(), **kwargs)
+
+
+def pinecone_transport_stats() -> dict:
+    return transport.transport_stats(_indexes.get(active_target()["index"]))
+
+
+def warm_up_pinecone():
+    """
+    Open the data-plane connection and exercise the embedding path once,
+    so the first real request doesn't pay for the handshakes.
+    """
+    index_call("describe_index_stats")
+    # Straight to the API: the shared embedding cache would answer this for every worker after the first.
+    target = active_target()
+    embed_texts(["warm up"], target["embed_model"], target["embed_input_type"])
+
+
+def embed_texts(texts: list[str], model: str, input_type: str) -> list[list[float]]:
+    resp = transport.call(
+        "embed",
+        transport.embed,
+        get_pinecone(),
+        model=model,
+        inputs=texts,
+        parameters={"input_type": input_type},
     )
-    if not resp.data:
+    if not resp.data or len(resp.data) != len(texts):
         raise ValueError("Embedding failed or returned empty result")
-    return resp.data[0]["values"]
+    return [d["values"] for d in resp.data]
+
+
+def _embed_text(text: str, target: dict | None = None) -> list[float]:
+    target = target or active_target()
+    key = shared_cache.embedding_key(target["embed_model"], target["embed_input_type"], text)
+    try:
+        cached = shared_cache.get_embedding(key)
+    except Exception:
+        cached = None
+    if cached is not None:
+        return cached
+
+    values = embed_texts([text], target["embed_model"], target["embed_input_type"])[0]
+    try:
+        shared_cache.put_embedding(key, values)
+    except Exception as e:
+        print(f"[cache] embedding write failed: {repr(e)}")
+    return values
+
+
+def _embed_for_write(text: str) -> tuple[dict, list[float]]:
+    """
+    Embed text with the model of the target it will be written to. Returns
+    (target, values); re-embeds if a migration switched targets meanwhile.
+    """
+    target = write_target()
+    while True:
+        values = _embed_text(text, target)
+        current = write_target()
+        if same_target(current, target):
+            return current, values
+        target = current
 
 
-def fetch_user_vector(user_id: str):
+def _after_user_write(
+    user_id: str,
+    target: dict,
+    written: dict | None = None,
+    base: dict | None = None,
+    replace: bool = False,
+):
+    # Cross-worker: every process reads the shared cache, so one write-through covers all of them.
+    # See shared_cache.record_user_write for written/base/replace.
+    try:
+        shared_cache.record_user_write(user_id, written, base=base, replace=replace)
+        shared_cache.mark_dirty_if_migrating(user_id, target_key(target))
+    except Exception as e:
+        print(f"[cache] write-through failed for {user_id}: {repr(e)}")
+
+
+def fetch_user_vector(user_id: str, fresh: bool = False):
+    """
+    Returns the user's vector record, or None. Served from the shared cache
+    when possible; cached records carry metadata only. fresh=True always asks
+    Pinecone (the cache is per box, so it can miss writes made by other
+    instances for up to USER_VECTOR_TTL_S).
+    """
+    if fresh:
+        resp = index_call("fetch", ids=[user_id])
+        return resp.vectors.get(user_id) if hasattr(resp, "vectors") else None
+    try:
+        metadata = shared_cache.get_user_metadata(user_id)
+        generation = shared_cache.user_generation(user_id)
+    except Exception:
+        metadata, generation = None, None
+    if metadata is not None:
+        return SimpleNamespace(id=user_id, metadata=metadata, values=None)
 
-    resp = index.fetch(ids=[user_id])
-    return resp.vectors.get(user_id) if hasattr(resp, "vectors") else None
+    resp = index_call("fetch", ids=[user_id])
+    vec = resp.vectors.get(user_id) if hasattr(resp, "vectors") else None
+    if vec is not None and generation is not None:
+        try:
+            shared_cache.put_user_metadata(user_id, dict(getattr(vec, "metadata", None) or {}), generation)
+        except Exception as e:
+            print(f"[cache] user vector write failed for {user_id}: {repr(e)}")
+    return vec
 
 
 def user_exists(user_id: str) -> bool:
     return fetch_user_vector(user_id) is not None
 
 
-def add_user_pinecone(user_id: str, username: str | None, text: str = "default user profile", bio: str | None = None):
-    text_to_embed = bio if (bio and bio.strip()) else text
-    embedding = _embed_text(text_to_embed)
+def normalize_bio(bio: str | None) -> str:
+    # Collapse runs of whitespace; the embedding doesn't care about them.
+    return " ".join((bio or "").split())
+
+
+def bio_hash(bio: str | None) -> str:
+    """
+    Content hash of a bio for change detection. Whitespace and case don't count.
+    """
+    norm = normalize_bio(bio).casefold()
+    return hashlib.sha256(norm.encode("utf-8")).hexdigest()[:32] if norm else ""
+
+
+def index_dimension(target: dict | None = None) -> int:
+    target = target or active_target()
+    name = target["index"] or ""
+    if name not in _dimensions:
+        stats = index_call("describe_index_stats", target=target)
+        _dimensions[name] = int(stats.dimension)
+    return _dimensions[name]
+
+
+def placeholder_vector(target: dict | None = None) -> list[float]:
+    # Stand-in until the user has a real bio; nothing queries by vector, and
+    # Pinecone rejects all-zero dense vectors.
+    return [1.0] + [0.0] * (index_dimension(target) - 1)
 
-    metadata: dict = {"user_id": user_id}
+
+def add_user_pinecone(user_id: str, username: str | None, bio: str | None = None):
+    """
+    Create the user's record. The bio is embedded when present; otherwise a
+    placeholder vector is stored and embedding waits for a real bio.
+    """
+    bio = (bio or "").strip()
+    metadata: dict = {"user_id": user_id, "bio_hash": bio_hash(bio), "embed_hash": ""}
     if username:
         metadata["username"] = str(username)
     if bio:
-        metadata["bio"] = str(bio)
-
-    index.upsert(vectors=[{
+        target, embedding = _embed_for_write(normalize_bio(bio))
+        metadata["bio"] = bio
+        metadata["embed_hash"] = metadata["bio_hash"]
+    else:
+        target = write_target()
+        embedding = placeholder_vector(target)
+
+    index_call("upsert", target=target, vectors=[{
         "id": user_id,
         "values": embedding,
         "metadata": metadata
     }])
+    _after_user_write(user_id, target, metadata, replace=True)
 
 
 def set_user_bio(user_id: str, bio: str):
-    index.update(id=user_id, set_metadata={"bio": str(bio)})
+    written = {"bio": str(bio), "bio_hash": bio_hash(bio)}
+    target = write_target()
+    index_call("update", target=target, id=user_id, set_metadata=written)
+    _after_user_write(user_id, target, written)
 
 
-def upsert_user_with_bio_reembed(user_id: str, username: str | None, bio: str):
-    embedding = _embed_text(bio)
-    metadata: dict = {"user_id": user_id, "bio": str(bio)}
-    if username:
-        metadata["username"] = str(username)
+def _embedded_hash(metadata: dict) -> str:
+    # Records written before bio hashing was added were always embedded from their bio.
+    if "embed_hash" in metadata:
+        return metadata.get("embed_hash") or ""
+    return bio_hash(metadata.get("bio"))
+
+
+def reembed_user_bio(user_id: str):
+    """
+    Bring the user's vector in line with the bio currently stored in metadata.
+    No-op if it already matches, so stale debounced calls cost one fetch.
+    """
+    vec = fetch_user_vector(user_id)
+    meta = (getattr(vec, "metadata", None) or {}) if vec else {}
+    bio = normalize_bio(meta.get("bio"))
+    h = bio_hash(bio)
+    if not bio or _embedded_hash(meta) == h:
+        return
+    target, embedding = _embed_for_write(bio)
+
+    # A newer edit may have landed while we were embedding (the cache holds every
+    # write made on this box); its own job will finish the work.
+    latest = fetch_user_vector(user_id)
+    latest_meta = (getattr(latest, "metadata", None) or {}) if latest else {}
+    if latest is None or bio_hash(latest_meta.get("bio")) != h:
+        return
+    if not same_target(write_target(), target):
+        # A migration flipped while we checked; embed again with the new model.
+        return reembed_user_bio(user_id)
+    index_call("update", target=target, id=user_id, values=embedding, set_metadata={"embed_hash": h})
+    _after_user_write(user_id, target, {"embed_hash": h}, base=latest_meta)
+
+
+def _run_deferred_reembed(user_id: str):
+    # Another worker may have taken the job over with a later edit; its timer runs it.
+    try:
+        mine = shared_cache.take_deferred_job(f"embed:{user_id}")
+    except Exception:
+        mine = True
+    if mine:
+        reembed_user_bio(user_id)
+
+
+def _schedule_reembed(user_id: str, restart: bool = True):
+    """
+    Re-embed BIO_EMBED_DEBOUNCE_S after the last edit from any worker.
+    restart=False leaves an already pending run where it is.
+    """
+    if BIO_EMBED_DEBOUNCE_S <= 0:
+        reembed_user_bio(user_id)
+        return
+    key = f"embed:{user_id}"
+    try:
+        if not restart and shared_cache.deferred_job_pending(key, within_s=2 * BIO_EMBED_DEBOUNCE_S):
+            return
+        shared_cache.defer_job(key)
+    except Exception as e:
+        print(f"[cache] defer failed for {key}: {repr(e)}")
+    debounce(key, BIO_EMBED_DEBOUNCE_S, _run_deferred_reembed, user_id)
 
-    index.upsert(vectors=[{
-        "id": user_id,
-        "values": embedding,
-        "metadata": metadata
-    }])
+
+def update_user_bio(user_id: str, bio: str, existing_metadata: dict | None) -> str:
+    """
+    Apply an incoming bio with the cheapest write that keeps Pinecone correct:
+      "unchanged" - nothing to write (a vector left behind by a lost re-embed
+                    is re-embedded)
+      "metadata"  - only formatting/case changed; metadata-only update
+      "reembed"   - content changed; metadata updated now, vector re-embedded
+                    after BIO_EMBED_DEBOUNCE_S so rapid edits embed once
+    Never rewrites the whole record, so ctx_* history is preserved.
+    """
+    meta = existing_metadata or {}
+    bio = (bio or "").strip()
+    if not bio:
+        return "unchanged"
+
+    h = bio_hash(bio)
+    if bio == (meta.get("bio") or "").strip():
+        # The metadata is written before the debounced embed, which a restart can lose.
+        if _embedded_hash(meta) != h:
+            _schedule_reembed(user_id, restart=False)
+        return "unchanged"
+
+    written = {"bio": bio, "bio_hash": h}
+    target = write_target()
+    index_call("update", target=target, id=user_id, set_metadata=written)
+    _after_user_write(user_id, target, written, base=meta)
+
+    if _embedded_hash(meta) == h:
+        return "metadata"
+    _schedule_reembed(user_id)
+    return "reembed"
 
 
 def get_context_from_pinecone(user_id: str):
@@ -77,11 +404,12 @@ def _ctx_key(interest: str) -> str:
     # Ensure stable, safe key names
     return f"ctx_{interest}"
 
-def get_interest_context(user_id: str, interest: str) -> list[dict]:
-    vec = fetch_user_vector(user_id)
-    if not vec or not getattr(vec, "metadata", None):
-        return []
-    raw = vec.metadata.get(_ctx_key(interest))
+def _user_metadata(user_id: str, fresh: bool = False) -> dict:
+    vec = fetch_user_vector(user_id, fresh=fresh)
+    return dict(getattr(vec, "metadata", None) or {}) if vec else {}
+
+def _ctx_list(metadata: dict, key: str) -> list[dict]:
+    raw = metadata.get(key)
     if not raw:
         return []
     try:
@@ -90,18 +418,11 @@ def get_interest_context(user_id: str, interest: str) -> list[dict]:
     except Exception:
         return []
 
+def get_interest_context(user_id: str, interest: str) -> list[dict]:
+    return _ctx_list(_user_metadata(user_id), _ctx_key(interest))
+
 def get_event_context(user_id: str) -> list[dict]:
-    vec = fetch_user_vector(user_id)
-    if not vec or not getattr(vec, "metadata", None):
-        return []
-    raw = vec.metadata.get("ctx_events")
-    if not raw:
-        return []
-    try:
-        data = json.loads(raw)
-        return data if isinstance(data, list) else []
-    except Exception:
-        return []
+    return _ctx_list(_user_metadata(user_id), "ctx_events")
 
 def append_interest_context(
     user_id: str,
@@ -112,7 +433,9 @@ def append_interest_context(
     """
     new_items: list of {name:str, reason:str, score:int, ts?:str}
     """
-    current = get_interest_context(user_id, interest)
+    # Read-merge-write: start from Pinecone, not a cache that may predate another instance's write.
+    base = _user_metadata(user_id, fresh=True)
+    current = _ctx_list(base, _ctx_key(interest))
 
     # Deduplicate by (name, reason) keeping highest score / most recent
     dedup = {(i.get("name","").strip().lower(), i.get("reason","").strip()): i for i in current}
@@ -139,10 +462,15 @@ def append_interest_context(
         merged = merged[:max_items]
 
     # Write back to metadata
-    index.update(
+    written = {_ctx_key(interest): json.dumps(merged, ensure_ascii=False)}
+    target = write_target()
+    index_call(
+        "update",
+        target=target,
         id=user_id,
-        set_metadata={_ctx_key(interest): json.dumps(merged, ensure_ascii=False)}
+        set_metadata=written
     )
+    _after_user_write(user_id, target, {**base, **written}, replace=True)
 
 def append_event_context(
     user_id: str,
@@ -152,7 +480,9 @@ def append_event_context(
     """
     new_items: list of {name:str, reason:str, score:int, ts?:str}
     """
-    current = get_event_context(user_id)
+    # Read-merge-write: start from Pinecone, not a cache that may predate another instance's write.
+    base = _user_metadata(user_id, fresh=True)
+    current = _ctx_list(base, "ctx_events")
 
     # Deduplicate by (name, reason) keeping highest score / most recent
     dedup = {(i.get("name","").strip().lower(), i.get("reason","").strip()): i for i in current}
@@ -179,7 +509,12 @@ def append_event_context(
         merged = merged[:max_items]
 
     # Write back to metadata
-    index.update(
+    written = {"ctx_events": json.dumps(merged, ensure_ascii=False)}
+    target = write_target()
+    index_call(
+        "update",
+        target=target,
         id=user_id,
-        set_metadata={"ctx_events": json.dumps(merged, ensure_ascii=False)}
-    )
\ No newline at end of file
+        set_metadata=written
+    )
+    _after_user_write(user_id, target, {**base, **written}, replace=True)
\ No newline at end of file
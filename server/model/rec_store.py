@@ -0,0 +1,90 @@
+import os
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List
+from model.shared_db import connect
+
+RECS_STORE_PATH = os.getenv("RECS_STORE_PATH", "/tmp/mingle_recs.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recs (
+    user_id     TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    scope       TEXT NOT NULL,
+    version     INTEGER NOT NULL,
+    input_hash  TEXT NOT NULL,
+    inputs      TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    computed_at REAL NOT NULL,
+    PRIMARY KEY (user_id, kind, scope)
+);
+"""
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(RECS_STORE_PATH, _SCHEMA)
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "user_id": row["user_id"],
+        "kind": row["kind"],
+        "scope": row["scope"],
+        "version": row["version"],
+        "input_hash": row["input_hash"],
+        "inputs": json.loads(row["inputs"]),
+        "payload": json.loads(row["payload"]),
+        "computed_at": row["computed_at"],
+    }
+
+
+def get_recs(user_id: str, kind: str, scope: str = "") -> Dict[str, Any] | None:
+    row = _conn().execute(
+        "SELECT * FROM recs WHERE user_id = ? AND kind = ? AND scope = ?",
+        (user_id, kind, scope),
+    ).fetchone()
+    return _row_to_dict(row) if row else None
+
+
+def list_recs(user_id: str) -> List[Dict[str, Any]]:
+    rows = _conn().execute("SELECT * FROM recs WHERE user_id = ?", (user_id,)).fetchall()
+    return [_row_to_dict(r) for r in rows]
+
+
+def put_recs(
+    user_id: str,
+    kind: str,
+    scope: str,
+    input_hash: str,
+    inputs: Dict[str, Any],
+    payload: List[Dict[str, Any]],
+) -> int:
+    """
+    Store a freshly computed result and return its version (bumped on every write).
+    """
+    conn = _conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO recs (user_id, kind, scope, version, input_hash, inputs, payload, computed_at)
+            VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT (user_id, kind, scope) DO UPDATE SET
+                version     = recs.version + 1,
+                input_hash  = excluded.input_hash,
+                inputs      = excluded.inputs,
+                payload     = excluded.payload,
+                computed_at = excluded.computed_at
+            """,
+            (
+                user_id, kind, scope, input_hash,
+                json.dumps(inputs, ensure_ascii=False),
+                json.dumps(payload, ensure_ascii=False),
+                time.time(),
+            ),
+        )
+        row = conn.execute(
+            "SELECT version FROM recs WHERE user_id = ? AND kind = ? AND scope = ?",
+            (user_id, kind, scope),
+        ).fetchone()
+    return int(row["version"])
@@ -0,0 +1,346 @@
+import os
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict
+from model.shared_db import connect
+
+# One file per box, read by every uvicorn worker; see model/shared_db.py.
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "/tmp/mingle_cache.sqlite3")
+USER_VECTOR_TTL_S = float(os.getenv("USER_VECTOR_TTL_S", "300"))
+EMBED_CACHE_TTL_S = float(os.getenv("EMBED_CACHE_TTL_S", str(7 * 24 * 3600)))
+# How long each worker trusts its last read of the migration setting.
+MIGRATION_CHECK_TTL_S = float(os.getenv("MIGRATION_CHECK_TTL_S", "1"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key        TEXT PRIMARY KEY,
+    vec        BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_vectors (
+    user_id    TEXT PRIMARY KEY,
+    metadata   TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_generations (
+    user_id    TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key   TEXT PRIMARY KEY,
+    until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deferred_jobs (
+    key        TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS migration_dirty (
+    user_id   TEXT PRIMARY KEY,
+    marked_at REAL NOT NULL
+);
+"""
+
+# Per-process counters; every worker reports its own.
+_stats: Dict[str, int] = {
+    "embed_hits": 0,
+    "embed_misses": 0,
+    "user_vector_hits": 0,
+    "user_vector_misses": 0,
+    "writes": 0,
+}
+_stats_lock = threading.Lock()
+_migration: Dict[str, Any] | None = None
+_migration_read_at = float("-inf")
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(SHARED_CACHE_PATH, _SCHEMA)
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return {**_stats, "pid": os.getpid()}
+
+
+# ---------- Embeddings ----------
+def embedding_key(model: str, input_type: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{input_type}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def get_embedding(key: str) -> list[float] | None:
+    row = _conn().execute(
+        "SELECT vec, created_at FROM embeddings WHERE key = ?", (key,)
+    ).fetchone()
+    if row is None or time.time() - row["created_at"] > EMBED_CACHE_TTL_S:
+        _count("embed_misses")
+        return None
+    _count("embed_hits")
+    return array("f", row["vec"]).tolist()
+
+
+def put_embedding(key: str, values: list[float]):
+    conn = _conn()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO embeddings (key, vec, created_at) VALUES (?, ?, ?)",
+            (key, array("f", values).tobytes(), time.time()),
+        )
+
+
+# ---------- User vectors ----------
+def user_generation(user_id: str) -> int:
+    row = _conn().execute(
+        "SELECT generation FROM user_generations WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return int(row["generation"]) if row else 0
+
+
+def get_user_metadata(user_id: str) -> Dict[str, Any] | None:
+    row = _conn().execute(
+        "SELECT metadata, fetched_at FROM user_vectors WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if row is None or time.time() - row["fetched_at"] > USER_VECTOR_TTL_S:
+        _count("user_vector_misses")
+        return None
+    _count("user_vector_hits")
+    return json.loads(row["metadata"])
+
+
+def put_user_metadata(user_id: str, metadata: Dict[str, Any], generation: int):
+    """
+    Cache metadata read at the given generation. Skipped if any worker has
+    written the user since, so a slow read can't overwrite a newer write, and
+    never replaces an unexpired entry (a write-through from record_user_write
+    is newer than anything a possibly lagging read returns).
+    """
+    now = time.time()
+    conn = _conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO user_vectors (user_id, metadata, generation, fetched_at)
+            SELECT ?, ?, ?, ?
+            WHERE COALESCE((SELECT generation FROM user_generations WHERE user_id = ?), 0) = ?
+              AND NOT EXISTS (SELECT 1 FROM user_vectors WHERE user_id = ? AND fetched_at >= ?)
+            """,
+            (
+                user_id, json.dumps(metadata, ensure_ascii=False), generation, now,
+                user_id, generation,
+                user_id, now - USER_VECTOR_TTL_S,
+            ),
+        )
+
+
+def record_user_write(
+    user_id: str,
+    set_metadata: Dict[str, Any] | None = None,
+    base: Dict[str, Any] | None = None,
+    replace: bool = False,
+):
+    """
+    Call after any write to the user. Bumps the generation and caches the
+    post-write metadata for every worker, instead of dropping the entry and
+    letting the next read refill it from a replica that may not have the
+    write yet.
+
+    set_metadata is what was written; it is merged over the cached entry, or
+    over base (the writer's own read) when nothing fresh is cached. replace
+    means set_metadata is the whole record. With nothing to build on, the
+    entry is dropped.
+    """
+    now = time.time()
+    conn = _conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO user_generations (user_id, generation) VALUES (?, 1)
+            ON CONFLICT (user_id) DO UPDATE SET generation = user_generations.generation + 1
+            """,
+            (user_id,),
+        )
+        generation = conn.execute(
+            "SELECT generation FROM user_generations WHERE user_id = ?", (user_id,)
+        ).fetchone()["generation"]
+
+        merged = None
+        if set_metadata is not None:
+            if replace:
+                merged = dict(set_metadata)
+            else:
+                row = conn.execute(
+                    "SELECT metadata, fetched_at FROM user_vectors WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if row is not None and now - row["fetched_at"] <= USER_VECTOR_TTL_S:
+                    merged = {**json.loads(row["metadata"]), **set_metadata}
+                elif base is not None:
+                    merged = {**base, **set_metadata}
+
+        if merged is None:
+            conn.execute("DELETE FROM user_vectors WHERE user_id = ?", (user_id,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_vectors (user_id, metadata, generation, fetched_at) VALUES (?, ?, ?, ?)",
+                (user_id, json.dumps(merged, ensure_ascii=False), generation, now),
+            )
+    _count("writes")
+
+
+# ---------- Leases ----------
+def try_lease(key: str, ttl_s: float) -> bool:
+    """
+    Claim key for ttl_s seconds across all workers. Returns False if another
+    worker already holds an unexpired lease.
+    """
+    now = time.time()
+    conn = _conn()
+    with conn:
+        cur = conn.execute(
+            """
+            INSERT INTO leases (key, until) VALUES (?, ?)
+            ON CONFLICT (key) DO UPDATE SET until = excluded.until
+            WHERE leases.until < ?
+            """,
+            (key, now + ttl_s, now),
+        )
+        return cur.rowcount == 1
+
+
+def release_lease(key: str):
+    conn = _conn()
+    with conn:
+        conn.execute("DELETE FROM leases WHERE key = ?", (key,))
+
+
+# ---------- Deferred jobs ----------
+def defer_job(key: str, owner: str | None = None):
+    """
+    Record that owner (default: this worker) now holds the pending run of a
+    debounced job. A later call from any worker takes it over, so edits that
+    land on different workers still run the job once.
+    """
+    conn = _conn()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO deferred_jobs (key, owner, updated_at) VALUES (?, ?, ?)",
+            (key, owner or str(os.getpid()), time.time()),
+        )
+
+
+def deferred_job_pending(key: str, within_s: float) -> bool:
+    """
+    True if some worker deferred key in the last within_s seconds and hasn't
+    run it yet. Older rows belong to workers that died before running them.
+    """
+    row = _conn().execute(
+        "SELECT 1 FROM deferred_jobs WHERE key = ? AND updated_at >= ?", (key, time.time() - within_s)
+    ).fetchone()
+    return row is not None
+
+
+def take_deferred_job(key: str, owner: str | None = None) -> bool:
+    """
+    Claim the pending run of key. False if another worker has taken it over
+    since, or it already ran.
+    """
+    conn = _conn()
+    with conn:
+        cur = conn.execute(
+            "DELETE FROM deferred_jobs WHERE key = ? AND owner = ?",
+            (key, owner or str(os.getpid())),
+        )
+        return cur.rowcount == 1
+
+
+# ---------- Settings / migrations ----------
+def get_setting(key: str) -> Any:
+    row = _conn().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return json.loads(row["value"]) if row else None
+
+
+def set_setting(key: str, value: Any):
+    conn = _conn()
+    with conn:
+        if value is None:
+            conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False)),
+            )
+
+
+def migration_state(fresh: bool = False) -> Dict[str, Any] | None:
+    """
+    The running migration's setting, or None. Cached per worker for
+    MIGRATION_CHECK_TTL_S so the common no-migration case costs no query.
+    """
+    global _migration, _migration_read_at
+    now = time.monotonic()
+    if fresh or now - _migration_read_at > MIGRATION_CHECK_TTL_S:
+        _migration = get_setting("migration")
+        _migration_read_at = now
+    return _migration
+
+
+def mark_dirty_if_migrating(user_id: str, written_to: str):
+    """
+    Remember a live write to the migration's source while a re-embed is
+    copying it, so the migration can re-copy that user before it finishes.
+    """
+    migration = migration_state()
+    if not migration or migration.get("source") != written_to:
+        return
+    conn = _conn()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO migration_dirty (user_id, marked_at) VALUES (?, ?)",
+            (user_id, time.time()),
+        )
+
+
+def take_dirty(limit: int, marked_before: float | None = None) -> list[str]:
+    conn = _conn()
+    cutoff = time.time() if marked_before is None else marked_before
+    rows = conn.execute(
+        "SELECT user_id, marked_at FROM migration_dirty WHERE marked_at <= ? LIMIT ?", (cutoff, limit)
+    ).fetchall()
+    with conn:
+        # Match on marked_at too, so a user re-marked meanwhile stays queued.
+        conn.executemany(
+            "DELETE FROM migration_dirty WHERE user_id = ? AND marked_at = ?",
+            [(r["user_id"], r["marked_at"]) for r in rows],
+        )
+    return [r["user_id"] for r in rows]
+
+
+def requeue_dirty(user_ids: list[str]):
+    """
+    Put users back after their re-copy failed. A newer mark, if any, is kept.
+    """
+    conn = _conn()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO migration_dirty (user_id, marked_at) VALUES (?, ?)",
+            [(u, time.time()) for u in user_ids],
+        )
+
+
+def clear_user_vectors():
+    conn = _conn()
+    with conn:
+        conn.execute("DELETE FROM user_vectors")
@@ -0,0 +1,31 @@
+import os
+import sqlite3
+import threading
+
+# Pages are memory-mapped, so every worker process on the box reads the same
+# page cache instead of keeping its own copy.
+SHARED_DB_MMAP_BYTES = int(os.getenv("SHARED_DB_MMAP_BYTES", str(64 * 1024 * 1024)))
+
+_local = threading.local()
+
+
+def connect(path: str, schema: str) -> sqlite3.Connection:
+    """
+    Return this thread's connection to the sqlite file at path, creating the
+    schema on first use. Connections are never reused across a fork.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "pid", None) != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={SHARED_DB_MMAP_BYTES}")
+        conn.executescript(schema)
+        conn.commit()
+        conns[path] = conn
+    return conn
@@ -0,0 +1,159 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict
+
+# Sync FastAPI routes run on anyio's thread pool; size the HTTP pool to match so
+# every worker thread can hold a kept-alive connection instead of opening new ones.
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+PINECONE_POOL_SIZE = int(os.getenv("PINECONE_POOL_SIZE", str(THREADPOOL_SIZE)))
+PINECONE_TIMEOUT_S = float(os.getenv("PINECONE_TIMEOUT_S", "10"))
+PINECONE_MAX_RETRIES = int(os.getenv("PINECONE_MAX_RETRIES", "3"))
+PINECONE_BACKOFF_BASE_S = float(os.getenv("PINECONE_BACKOFF_BASE_S", "0.2"))
+PINECONE_BACKOFF_MAX_S = float(os.getenv("PINECONE_BACKOFF_MAX_S", "2.0"))
+
+_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def build_client(api_key: str | None):
+    from pinecone import Pinecone
+    return Pinecone(api_key=api_key, pool_threads=PINECONE_POOL_SIZE)
+
+
+def build_index(pc, index_name: str | None):
+    # The SDK's urllib3 layer retries on its own; turn that off for the data plane
+    # so call() is the only retry loop. Resolve the host first (control plane, SDK
+    # defaults) and give the index its own copy of the config, so the client's
+    # shared config and its control-plane calls keep their retries.
+    import copy
+    from urllib3.util.retry import Retry
+    from pinecone.db_data import _Index
+    from pinecone.utils import normalize_host
+    host = call("describe_index", pc.describe_index, index_name).host
+    openapi_config = copy.copy(pc._openapi_config)
+    openapi_config.retries = Retry(total=0, raise_on_status=False)
+    return _Index(
+        host=normalize_host(host),
+        api_key=pc._config.api_key,
+        pool_threads=PINECONE_POOL_SIZE,
+        openapi_config=openapi_config,
+        source_tag=pc._config.source_tag,
+        connection_pool_maxsize=PINECONE_POOL_SIZE,
+    )
+
+
+def embed(pc, model: str, inputs: list[str], parameters: dict):
+    """
+    pc.inference.embed() with the per-call timeout. The public method takes
+    no timeout, so this goes through the generated API client it wraps.
+    """
+    inference = pc.inference
+    api = getattr(inference, "_Inference__inference_api", None)
+    if api is None:
+        # SDK layout changed; still works, just without the timeout.
+        return inference.embed(model=model, inputs=inputs, parameters=parameters)
+    from pinecone.inference.inference_request_builder import InferenceRequestBuilder
+    from pinecone.inference.models import EmbeddingsList
+    request = InferenceRequestBuilder.embed_request(model=model, inputs=inputs, parameters=parameters)
+    return EmbeddingsList(api.embed(embed_request=request, _request_timeout=PINECONE_TIMEOUT_S))
+
+
+def timeout_kwargs() -> dict:
+    return {"_request_timeout": PINECONE_TIMEOUT_S}
+
+
+def _is_timeout(e: Exception) -> bool:
+    if isinstance(e, TimeoutError):
+        return True
+    return "Timeout" in type(e).__name__
+
+
+def _is_retryable(e: Exception) -> bool:
+    status = getattr(e, "status", None)
+    if isinstance(status, int):
+        return status in _RETRYABLE_STATUS
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    if "ProtocolError" in type(e).__name__:
+        return True
+    try:
+        import urllib3
+        return isinstance(e, urllib3.exceptions.HTTPError)
+    except ImportError:
+        return False
+
+
+def _record(op: str, elapsed_s: float, retries: int, error: Exception | None):
+    with _stats_lock:
+        s = _stats.setdefault(op, {"calls": 0, "errors": 0, "retries": 0, "timeouts": 0, "total_ms": 0.0})
+        s["calls"] += 1
+        s["retries"] += retries
+        s["total_ms"] += elapsed_s * 1000
+        if error is not None:
+            s["errors"] += 1
+            if _is_timeout(error):
+                s["timeouts"] += 1
+
+
+def call(op: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run one Pinecone call with full-jitter exponential backoff on transient
+    failures (throttling, 5xx, dropped connections, timeouts).
+    """
+    t0 = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= PINECONE_MAX_RETRIES or not _is_retryable(e):
+                _record(op, time.monotonic() - t0, attempt, e)
+                raise
+            delay = min(PINECONE_BACKOFF_MAX_S, PINECONE_BACKOFF_BASE_S * (2 ** attempt))
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+            continue
+        _record(op, time.monotonic() - t0, attempt, None)
+        return result
+
+
+def _pool_stats(index) -> list[dict]:
+    # Reaches into the generated REST client; returns [] if the SDK layout changes.
+    try:
+        pools = index._vector_api.api_client.rest_client.pool_manager.pools
+        out = []
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened = int(getattr(pool, "num_connections", 0))
+            requests = int(getattr(pool, "num_requests", 0))
+            out.append({
+                "host": getattr(pool, "host", None),
+                "maxsize": getattr(pool, "maxsize", None),
+                "idle": pool.pool.qsize() if getattr(pool, "pool", None) is not None else None,
+                "connections_opened": opened,
+                "requests": requests,
+                "reuse_ratio": round(1 - opened / requests, 4) if requests else None,
+            })
+        return out
+    except Exception:
+        return []
+
+
+def transport_stats(index=None) -> dict:
+    with _stats_lock:
+        ops = {}
+        for op, s in _stats.items():
+            ops[op] = {**s, "avg_ms": round(s["total_ms"] / s["calls"], 2) if s["calls"] else 0.0}
+    return {
+        "pool_size": PINECONE_POOL_SIZE,
+        "timeout_s": PINECONE_TIMEOUT_S,
+        "max_retries": PINECONE_MAX_RETRIES,
+        "ops": ops,
+        "pools": [] if index is None else _pool_stats(index),
+    }
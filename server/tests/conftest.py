@@ -0,0 +1,104 @@
+import copy
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# The app imports its packages relative to server/, like uvicorn/gunicorn do.
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+
+class FakeIndex:
+    """
+    In-memory stand-in for one Pinecone namespace. Set `lagging` to make
+    fetch() answer from a snapshot, like a replica that hasn't seen the
+    latest writes.
+    """
+
+    def __init__(self):
+        self.records: dict = {}
+        self.calls: list = []
+        self.lagging: dict | None = None
+
+    def snapshot(self):
+        self.lagging = copy.deepcopy(self.records)
+
+    def fetch(self, ids):
+        source = self.records if self.lagging is None else self.lagging
+        vectors = {
+            i: SimpleNamespace(id=i, values=list(source[i]["values"]), metadata=dict(source[i]["metadata"]))
+            for i in ids if i in source
+        }
+        return SimpleNamespace(vectors=vectors)
+
+    def upsert(self, vectors):
+        for v in vectors:
+            self.records[v["id"]] = {"values": list(v["values"]), "metadata": dict(v.get("metadata") or {})}
+
+    def update(self, id, values=None, set_metadata=None):
+        rec = self.records[id]
+        if values is not None:
+            rec["values"] = list(values)
+        rec["metadata"].update(set_metadata or {})
+
+    def list_paginated(self, limit, pagination_token=None):
+        ids = sorted(self.records)
+        start = int(pagination_token or 0)
+        page = ids[start:start + limit]
+        nxt = str(start + limit) if start + limit < len(ids) else None
+        return SimpleNamespace(
+            vectors=[SimpleNamespace(id=i) for i in page],
+            pagination=SimpleNamespace(next=nxt) if nxt else None,
+        )
+
+    def describe_index_stats(self):
+        return SimpleNamespace(dimension=4)
+
+
+@pytest.fixture
+def fake_pinecone(tmp_path, monkeypatch):
+    """
+    Route model.pinecone through FakeIndex objects (one per index/namespace)
+    and a throwaway shared cache. Embeddings are counted in `embeds`.
+    """
+    from helpers import jobs
+    from model import pinecone, shared_cache
+
+    monkeypatch.setattr(shared_cache, "SHARED_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(shared_cache, "_migration", None)
+    monkeypatch.setattr(shared_cache, "_migration_read_at", float("-inf"))
+    monkeypatch.setattr(pinecone, "_target", None)
+    monkeypatch.setattr(pinecone, "_dimensions", {})
+
+    indexes: dict = {}
+    embeds: list = []
+
+    def index_for(target=None):
+        return indexes.setdefault(pinecone.target_key(target or pinecone.active_target()), FakeIndex())
+
+    def index_call(op, target=None, **kwargs):
+        idx = index_for(target)
+        idx.calls.append((op, kwargs))
+        kwargs.pop("namespace", None)
+        return getattr(idx, op)(**kwargs)
+
+    def embed_texts(texts, model, input_type):
+        # Recorded per call as text, or (model, text) when not the default model.
+        embeds.extend(t if model == pinecone.EMBED_MODEL else (model, t) for t in texts)
+        return [[float(len(t)), 1.0, 0.0, 0.0] for t in texts]
+
+    monkeypatch.setattr(pinecone, "index_call", index_call)
+    monkeypatch.setattr(pinecone, "embed_texts", embed_texts)
+    yield SimpleNamespace(
+        index_for=index_for,
+        indexes=indexes,
+        embeds=embeds,
+        module=pinecone,
+        index_call=index_call,
+        embed_texts=embed_texts,
+    )
+    # Don't let a debounced re-embed fire into the next test.
+    jobs.flush_debounced()
@@ -0,0 +1,59 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from agent import agent
+
+
+def _reply(*recs):
+    return json.dumps({"recommendations": list(recs)})
+
+
+class FakeLLM:
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    def invoke(self, prompt, generation_config=None):
+        self.prompts.append(prompt)
+        return SimpleNamespace(content=self.replies.pop(0))
+
+
+def test_validate_rejects_out_of_range_id():
+    with pytest.raises(ValueError, match="out of range 0-2"):
+        agent._validate_recs(_reply({"id": "3", "score": 80, "reason": "x"}), 3)
+
+
+def test_validate_rejects_non_integer_score():
+    with pytest.raises(ValueError, match="not an integer"):
+        agent._validate_recs(_reply({"id": "0", "score": "high", "reason": "x"}), 3)
+
+
+def test_validate_keeps_first_of_duplicate_ids_and_clamps_score():
+    recs = agent._validate_recs(
+        _reply(
+            {"id": "1", "score": 150, "reason": " first "},
+            {"id": "1", "score": 10, "reason": "again"},
+            {"id": "0", "score": 40, "reason": "other"},
+        ),
+        3,
+    )
+    assert recs == [
+        {"id": 1, "score": 100, "reason": "first"},
+        {"id": 0, "score": 40, "reason": "other"},
+    ]
+
+
+def test_one_repair_fixes_bad_reply():
+    llm = FakeLLM("not json", _reply({"id": "2", "score": 70, "reason": "fits"}))
+    recs = agent.recommend_names_from_pool("bio", [], ["Ann", "Bo", "Cy"], llm=llm)
+    assert recs == [{"name": "Cy", "score": 70, "reason": "fits"}]
+    assert "previous reply was rejected" in llm.prompts[1]
+
+
+def test_exhausted_repairs_raise(monkeypatch):
+    monkeypatch.setattr(agent, "LLM_MAX_REPAIRS", 1)
+    llm = FakeLLM(_reply({"id": "9", "score": 1, "reason": "x"}), "still not json")
+    with pytest.raises(ValueError, match="still invalid after 2 attempts"):
+        agent.recommend_names_from_pool("bio", [], ["Ann", "Bo"], llm=llm)
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from helpers import jobs
+from model import shared_cache
+
+
+@pytest.fixture
+def pc(fake_pinecone, monkeypatch):
+    monkeypatch.setattr(fake_pinecone.module, "BIO_EMBED_DEBOUNCE_S", 0.05)
+    fake_pinecone.module.add_user_pinecone("u1", "ann", bio="I like chess")
+    fake_pinecone.embeds.clear()
+    fake_pinecone.index_for().calls.clear()
+    return fake_pinecone
+
+
+def _meta(pc):
+    return dict(pc.module.fetch_user_vector("u1").metadata)
+
+
+def _updates(pc):
+    return [kw for op, kw in pc.index_for().calls if op == "update"]
+
+
+def test_same_bio_is_unchanged(pc):
+    assert pc.module.update_user_bio("u1", "  I like chess ", _meta(pc)) == "unchanged"
+    assert _updates(pc) == []
+    assert jobs.job_stats()["pending_debounced"] == 0
+
+
+def test_case_only_edit_is_metadata_only(pc):
+    assert pc.module.update_user_bio("u1", "i LIKE  chess", _meta(pc)) == "metadata"
+    time.sleep(0.2)
+    assert [u["set_metadata"]["bio"] for u in _updates(pc)] == ["i LIKE  chess"]
+    assert pc.embeds == []
+
+
+def test_rapid_edits_embed_once(pc):
+    for bio in ("I like go", "I like go and tea", "I like go and jazz"):
+        assert pc.module.update_user_bio("u1", bio, _meta(pc)) == "reembed"
+    time.sleep(0.3)
+    assert pc.embeds == ["I like go and jazz"]
+    rec = pc.index_for().records["u1"]
+    assert rec["metadata"]["embed_hash"] == pc.module.bio_hash("I like go and jazz")
+
+
+def test_lost_reembed_is_redone_when_bio_is_seen_again(pc):
+    pc.module.update_user_bio("u1", "I like go", _meta(pc))
+    # The process stops before the timer fires: the timer and its deferred row are gone.
+    with jobs._inflight_lock:
+        for t in jobs._timers.values():
+            t.cancel()
+        jobs._timers.clear()
+    shared_cache.take_deferred_job("embed:u1")
+
+    assert pc.module.update_user_bio("u1", "I like go", _meta(pc)) == "unchanged"
+    time.sleep(0.3)
+    assert pc.embeds == ["I like go"]
+
+
+def test_edit_taken_over_by_another_worker_is_left_to_it(pc):
+    pc.module.update_user_bio("u1", "I like go", _meta(pc))
+    shared_cache.defer_job("embed:u1", owner="other-worker")
+    time.sleep(0.3)
+    assert pc.embeds == []
+    assert shared_cache.take_deferred_job("embed:u1", owner="other-worker")
+
+
+def test_shutdown_flushes_pending_reembed(pc, monkeypatch):
+    monkeypatch.setattr(pc.module, "BIO_EMBED_DEBOUNCE_S", 60)
+    pc.module.update_user_bio("u1", "I like go", _meta(pc))
+    jobs.shutdown(wait=True)
+    assert pc.embeds == ["I like go"]
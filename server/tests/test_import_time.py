@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+from conftest import SERVER_DIR
+
+# Generous for CI; a cold import is well under a second on a laptop.
+IMPORT_BUDGET_S = 3.0
+
+_PROBE = textwrap.dedent(
+    """
+    import json, socket, sys, time
+
+    def _no_network(*args, **kwargs):
+        raise AssertionError("network access during import")
+
+    socket.socket.connect = _no_network
+    socket.create_connection = _no_network
+
+    t0 = time.perf_counter()
+    import main
+    elapsed = time.perf_counter() - t0
+
+    import model.pinecone as pc
+    import agent.agent as agent
+    print(json.dumps({
+        "elapsed": elapsed,
+        "pinecone_client": pc._pc is not None,
+        "indexes": len(pc._indexes),
+        "llm": agent._llm is not None,
+    }))
+    """
+)
+
+
+def test_import_main_is_offline_and_fast(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k not in ("PINECONE_API_KEY", "GOOGLE_API_KEY")}
+    env["SHARED_CACHE_PATH"] = str(tmp_path / "cache.sqlite3")
+    env["RECS_STORE_PATH"] = str(tmp_path / "recs.sqlite3")
+    proc = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=SERVER_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert proc.returncode == 0, proc.stderr
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    assert not result["pinecone_client"]
+    assert result["indexes"] == 0
+    assert not result["llm"]
+    assert result["elapsed"] < IMPORT_BUDGET_S, f"import main took {result['elapsed']:.2f}s"
+    # Nothing touches the shared sqlite files until the first request.
+    assert not (tmp_path / "cache.sqlite3").exists()
+    assert not (tmp_path / "recs.sqlite3").exists()
+
+
+def test_only_entry_points_load_dotenv():
+    probe = textwrap.dedent(
+        """
+        import dotenv
+        calls = []
+        dotenv.load_dotenv = lambda *a, **k: calls.append(1)
+        import helpers.extractToken, helpers.jobs, helpers.warmup
+        import model.pinecone, model.transport, model.rec_store, model.shared_cache, agent.agent
+        print(len(calls))
+        """
+    )
+    proc = subprocess.run([sys.executable, "-c", probe], cwd=SERVER_DIR, capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "0"
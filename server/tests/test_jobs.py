@@ -0,0 +1,35 @@
+import threading
+import time
+
+from helpers import jobs
+
+
+def test_debounce_runs_only_the_last_call():
+    ran = []
+    for i in range(3):
+        jobs.debounce("test:last", 0.05, ran.append, i)
+    time.sleep(0.3)
+    assert ran == [2]
+
+
+def test_flush_runs_pending_calls_now():
+    ran = []
+    jobs.debounce("test:flush", 60, ran.append, "x")
+    jobs.flush_debounced()
+    assert ran == ["x"]
+    assert jobs.job_stats()["pending_debounced"] == 0
+
+
+def test_submit_dedupes_inflight_keys():
+    gate = threading.Event()
+    ran = []
+
+    def job(i):
+        gate.wait(5)
+        ran.append(i)
+
+    assert jobs.submit("test:dedupe", job, 1)
+    assert not jobs.submit("test:dedupe", job, 2)
+    gate.set()
+    jobs.shutdown(wait=True)
+    assert ran == [1]
@@ -0,0 +1,99 @@
+import pytest
+
+import main
+from model import rec_store, shared_cache
+
+
+@pytest.fixture
+def recs(tmp_path, monkeypatch):
+    """
+    Store and leases on throwaway files; the LLM compute is a stub that
+    stores its result, and background jobs are recorded instead of run.
+    """
+    monkeypatch.setattr(rec_store, "RECS_STORE_PATH", str(tmp_path / "recs.sqlite3"))
+    monkeypatch.setattr(shared_cache, "SHARED_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    computed, jobs = [], []
+
+    def compute(user_id, inputs):
+        computed.append(inputs)
+        items = [main.RecommendationItem(name=n, score=90 - i, reason=inputs["bio"]) for i, n in enumerate(inputs["names"])]
+        return main._store_recs(user_id, "people", inputs["interest"], inputs, items), items
+
+    monkeypatch.setitem(main._COMPUTE, "people", compute)
+    monkeypatch.setattr(main, "submit_job", lambda key, fn, *args: jobs.append((key, args)) or True)
+    return computed, jobs
+
+
+def _inputs(bio="likes chess", names=("Ann", "Bo")):
+    return {"bio": bio, "snippets": [], "names": list(names), "profile": "", "interest": "Social", "top_k": len(names)}
+
+
+def test_empty_result_is_not_stored(recs):
+    inputs = {"bio": "b", "top_k": 1}
+
+    assert main._store_recs("u1", "people", "Social", inputs, []) is None
+    assert rec_store.get_recs("u1", "people", "Social") is None
+
+    item = main.RecommendationItem(name="Ann", score=80, reason="fits")
+    assert main._store_recs("u1", "people", "Social", inputs, [item]) == 1
+    assert rec_store.get_recs("u1", "people", "Social")["payload"] == [item.model_dump()]
+
+
+def test_entry_from_old_bio_is_recomputed_not_served_stale(recs):
+    computed, jobs = recs
+    main._materialized_recs("people", "u1", "Social", _inputs(), ["Ann", "Bo"])
+
+    items, version, cached, stale = main._materialized_recs(
+        "people", "u1", "Social", _inputs(bio="likes jazz"), ["Ann", "Bo"]
+    )
+
+    assert (cached, stale, version) == (False, False, 2)
+    assert {i.reason for i in items} == {"likes jazz"}
+    assert len(computed) == 2 and jobs == []
+
+
+def test_miss_computes_inline(recs):
+    computed, jobs = recs
+    items, version, cached, stale = main._materialized_recs("people", "u1", "Social", _inputs(), ["Ann", "Bo"])
+    assert (version, cached, stale) == (1, False, False)
+    assert [i.name for i in items] == ["Ann", "Bo"]
+    assert len(computed) == 1 and jobs == []
+
+
+def test_fresh_entry_is_served_without_compute(recs):
+    computed, jobs = recs
+    main._materialized_recs("people", "u1", "Social", _inputs(), ["Ann", "Bo"])
+
+    items, version, cached, stale = main._materialized_recs("people", "u1", "Social", _inputs(), ["Ann", "Bo"])
+
+    assert (version, cached, stale) == (1, True, False)
+    assert [i.name for i in items] == ["Ann", "Bo"]
+    assert len(computed) == 1 and jobs == []
+
+
+def test_stale_entry_is_served_and_refreshed_once(recs, monkeypatch):
+    computed, jobs = recs
+    main._materialized_recs("people", "u1", "Social", _inputs(), ["Ann", "Bo"])
+    monkeypatch.setattr(main, "RECS_TTL_S", -1)  # everything is stale now
+    new_pool = _inputs(names=("Bo", "Cy"))
+
+    for _ in range(2):
+        items, version, cached, stale = main._materialized_recs("people", "u1", "Social", new_pool, ["Bo", "Cy"])
+        # Served from the old entry, restricted to the candidates still in the pool.
+        assert (version, cached, stale) == (1, True, True)
+        assert [i.name for i in items] == ["Bo"]
+
+    # The lease lets only the first request queue a refresh.
+    assert len(computed) == 1
+    assert jobs == [("people:u1:Social", ("people:u1:Social", "people", "u1", new_pool))]
+
+
+def test_bio_change_queues_refresh_of_other_entries(recs):
+    computed, jobs = recs
+    main._materialized_recs("people", "u1", "Social", _inputs(), ["Ann", "Bo"])
+    main._materialized_recs("people", "u1", "Creative", {**_inputs(), "interest": "Creative"}, ["Ann", "Bo"])
+
+    main._refresh_after_bio_change("u1", "  likes   jazz ", skip=("people", "Social"))
+    main._refresh_after_bio_change("u1", "likes jazz", skip=("people", "Social"))
+
+    assert [(key, args[-1]["bio"]) for key, args in jobs] == [("people:u1:Creative", "likes jazz")]
@@ -0,0 +1,208 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from admin import reembed
+from model import shared_cache
+
+
+@pytest.fixture
+def migration(fake_pinecone, tmp_path, monkeypatch):
+    monkeypatch.setattr(reembed, "index_call", fake_pinecone.index_call)
+    monkeypatch.setattr(reembed, "embed_texts", fake_pinecone.embed_texts)
+    monkeypatch.setattr(reembed, "ACTIVE_TARGET_TTL_S", 0)
+    monkeypatch.setattr(fake_pinecone.module, "ACTIVE_TARGET_TTL_S", 0)
+    monkeypatch.setattr(fake_pinecone.module, "BIO_EMBED_DEBOUNCE_S", 0)
+    monkeypatch.setattr(shared_cache, "MIGRATION_CHECK_TTL_S", 0)
+
+    pc = fake_pinecone.module
+    for i in range(7):
+        pc.add_user_pinecone(f"u{i}", f"user{i}", bio=f"bio number {i}")
+    fake_pinecone.embeds.clear()
+
+    source = dict(pc.active_target())
+    target = {**source, "namespace": "v2", "embed_model": "new-model"}
+    args = SimpleNamespace(
+        target_index=None,
+        target_namespace="v2",
+        model="new-model",
+        input_type=source["embed_input_type"],
+        page_size=2,
+        embed_batch=96,
+        upsert_batch=100,
+        concurrency=3,
+        max_rps=0,
+        checkpoint=str(tmp_path / "ckpt.json"),
+        restart=False,
+    )
+    return SimpleNamespace(fake=fake_pinecone, pc=pc, source=source, target=target, args=args)
+
+
+def _fresh_ckpt(m):
+    return {
+        "source": m.source, "target": m.target, "phase": "copy",
+        "pagination_token": None, "pages_done": 0, "copied": 0, "failed_ids": [],
+    }
+
+
+def test_copy_phase_checkpoints_in_page_order_and_resumes(migration, monkeypatch):
+    m = migration
+    real_copy = reembed.copy_ids
+    committed = []
+
+    def copy_ids(ids, *rest):
+        if ids[0] == "u0":
+            time.sleep(0.2)  # the first page finishes last
+        if ids[0] == "u4":
+            raise RuntimeError("crash")
+        return real_copy(ids, *rest)
+
+    monkeypatch.setattr(reembed, "copy_ids", copy_ids)
+    real_save = reembed._save_checkpoint
+    monkeypatch.setattr(
+        reembed, "_save_checkpoint",
+        lambda path, ckpt: (committed.append(ckpt["pagination_token"]), real_save(path, ckpt)),
+    )
+
+    ckpt = _fresh_ckpt(m)
+    with pytest.raises(RuntimeError):
+        reembed._copy_phase(ckpt, m.source, m.target, m.args, reembed.RateLimiter(0))
+
+    # Pages 0 and 1 committed in order, even though page 1 finished first; the crash stops at page 2.
+    assert committed == ["2", "4"]
+    saved = json.load(open(m.args.checkpoint))
+    assert saved["pagination_token"] == "4" and saved["pages_done"] == 2
+
+    monkeypatch.setattr(reembed, "copy_ids", real_copy)
+    reembed._copy_phase(saved, m.source, m.target, m.args, reembed.RateLimiter(0))
+    assert saved["pages_done"] == 4 and saved["copied"] == 7
+    assert sorted(m.fake.index_for(m.target).records) == [f"u{i}" for i in range(7)]
+    # Resumed from page 2: users from committed pages were not copied again.
+    assert [t for _, t in m.fake.embeds].count("bio number 0") == 1
+
+
+def test_take_dirty_keeps_users_marked_again(migration):
+    shared_cache.set_setting("migration", {"source": reembed.target_key(migration.source), "target": "x"})
+    for u in ("a", "b", "c"):
+        shared_cache.mark_dirty_if_migrating(u, reembed.target_key(migration.source))
+    shared_cache.mark_dirty_if_migrating("z", "some/other-namespace")
+
+    first = shared_cache.take_dirty(2)
+    assert len(first) == 2
+    time.sleep(0.01)
+    shared_cache.mark_dirty_if_migrating(first[0], reembed.target_key(migration.source))
+
+    rest = shared_cache.take_dirty(10)
+    assert sorted(rest) == sorted({"a", "b", "c"} - set(first) | {first[0]})
+    assert shared_cache.take_dirty(10) == []
+
+
+def test_mark_dirty_skips_sqlite_when_no_migration(migration, monkeypatch):
+    monkeypatch.setattr(shared_cache, "MIGRATION_CHECK_TTL_S", 60)
+    shared_cache.migration_state(fresh=True)
+    opened = []
+    real_conn = shared_cache._conn
+    monkeypatch.setattr(shared_cache, "_conn", lambda: opened.append(1) or real_conn())
+
+    shared_cache.mark_dirty_if_migrating("u1", reembed.target_key(migration.source))
+    assert opened == []
+
+
+def test_writes_wait_for_flip_and_land_in_new_target(migration):
+    m = migration
+    shared_cache.set_setting("migration", {"source": "s", "target": "t", "frozen": True, "frozen_at": time.time()})
+    done = threading.Event()
+
+    def write():
+        m.pc.append_event_context("u1", [{"name": "Jazz", "reason": "music", "score": 70}])
+        done.set()
+
+    m.fake.index_for(m.target).records["u1"] = {"values": [0.0] * 4, "metadata": {}}
+    t = threading.Thread(target=write)
+    t.start()
+    assert not done.wait(0.5)
+
+    m.pc.set_active_target(m.target)
+    shared_cache.set_setting("migration", {"source": "s", "target": "t", "flipped": True})
+    assert done.wait(5)
+    assert "ctx_events" in m.fake.index_for(m.target).records["u1"]["metadata"]
+    assert "ctx_events" not in m.fake.index_for(m.source).records["u1"]["metadata"]
+
+
+def test_reembed_started_before_flip_uses_new_model(migration, monkeypatch):
+    m = migration
+    pc = m.pc
+    pc.update_user_bio("u1", "now I like jazz", pc.fetch_user_vector("u1").metadata)  # embeds inline
+    m.fake.embeds.clear()
+    m.fake.index_for(m.source).calls.clear()
+    m.fake.index_for(m.target).records["u1"] = {"values": [0.0] * 4, "metadata": {"bio": "now I like jazz"}}
+
+    real_embed = pc._embed_text
+    flipped = []
+
+    def embed_then_flip(text, target=None):
+        values = real_embed(text, target)
+        if not flipped:
+            flipped.append(1)
+            pc.set_active_target(m.target)
+        return values
+
+    monkeypatch.setattr(pc, "_embed_text", embed_then_flip)
+    shared_cache.record_user_write("u1", {"embed_hash": ""})  # make the vector look out of date
+    pc.reembed_user_bio("u1")
+
+    # The old-model embed came from the embedding cache; the write waited for a new-model one.
+    assert m.fake.embeds == [("new-model", "now I like jazz")]
+    assert m.fake.index_for(m.target).records["u1"]["metadata"]["embed_hash"] == pc.bio_hash("now I like jazz")
+    assert [op for op, _ in m.fake.index_for(m.source).calls if op == "update"] == []
+
+
+def test_full_run_switches_target(migration):
+    m = migration
+    assert reembed.run(m.args) == 0
+    assert reembed.target_key(m.pc.active_target(fresh=True)) == reembed.target_key(m.target)
+    assert shared_cache.get_setting("migration") is None
+    assert sorted(m.fake.index_for(m.target).records) == [f"u{i}" for i in range(7)]
+    assert json.load(open(m.args.checkpoint))["phase"] == "done"
+
+
+def test_failed_live_copies_stay_queued_and_block_the_switch(migration, monkeypatch):
+    m = migration
+    ckpt = {**_fresh_ckpt(m), "phase": "flip"}
+    reembed._save_checkpoint(m.args.checkpoint, ckpt)
+    shared_cache.set_setting("migration", {"source": reembed.target_key(m.source), "target": "x"})
+    shared_cache.mark_dirty_if_migrating("u1", reembed.target_key(m.source))
+
+    def embed_down(texts, model, input_type):
+        raise RuntimeError("embed down")
+
+    monkeypatch.setattr(reembed, "embed_texts", embed_down)
+    assert reembed.run(m.args) == 1
+
+    assert shared_cache.take_dirty(10) == ["u1"]
+    assert reembed.target_key(m.pc.active_target(fresh=True)) == reembed.target_key(m.source)
+    migration_setting = shared_cache.get_setting("migration")
+    assert migration_setting and not migration_setting.get("frozen")
+
+
+def test_slow_final_copy_releases_writes_without_switching(migration, monkeypatch):
+    m = migration
+    ckpt = {**_fresh_ckpt(m), "phase": "flip"}
+    reembed._save_checkpoint(m.args.checkpoint, ckpt)
+    monkeypatch.setattr(reembed, "MIGRATION_FREEZE_MAX_S", 0)
+
+    assert reembed.run(m.args) == 1
+    assert reembed.target_key(m.pc.active_target(fresh=True)) == reembed.target_key(m.source)
+    assert not shared_cache.get_setting("migration").get("frozen")
+
+
+def test_held_writer_gives_up_at_cap_from_first_freeze(migration, monkeypatch):
+    m = migration
+    monkeypatch.setattr(m.pc, "MIGRATION_FREEZE_MAX_S", 1)
+    shared_cache.set_setting("migration", {"source": "s", "target": "t", "frozen": True, "frozen_at": time.time() - 0.8})
+    t0 = time.monotonic()
+    m.pc.write_target()
+    assert time.monotonic() - t0 < 0.8
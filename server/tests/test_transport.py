@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import pytest
+
+from model import transport
+
+
+def test_build_index_leaves_shared_config_alone(monkeypatch):
+    from pinecone import Pinecone
+
+    pc = Pinecone(api_key="test-key")
+    sdk_retries = pc._openapi_config.retries
+    monkeypatch.setattr(pc, "describe_index", lambda name: SimpleNamespace(host=f"{name}-abc.svc.pinecone.io"))
+
+    idx = transport.build_index(pc, "users")
+
+    pool_kw = idx._vector_api.api_client.rest_client.pool_manager.connection_pool_kw
+    assert pool_kw["retries"].total == 0
+    assert pool_kw["maxsize"] == transport.PINECONE_POOL_SIZE
+    assert pc._openapi_config.retries is sdk_retries
+
+
+def test_call_retries_transient_errors_only(monkeypatch):
+    monkeypatch.setattr(transport, "PINECONE_BACKOFF_BASE_S", 0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert transport.call("test_flaky", flaky) == "ok"
+    assert len(attempts) == 3
+
+    def bad_request():
+        err = Exception("bad request")
+        err.status = 400
+        raise err
+
+    with pytest.raises(Exception, match="bad request"):
+        transport.call("test_bad", bad_request)
+    assert transport.transport_stats()["ops"]["test_bad"]["retries"] == 0
@@ -0,0 +1,67 @@
+from model import shared_cache
+
+
+def test_write_through_survives_lagging_read(fake_pinecone):
+    pc = fake_pinecone.module
+    pc.add_user_pinecone("u1", "ann", bio="likes chess")
+    idx = fake_pinecone.index_for()
+    idx.snapshot()  # reads now lag behind the next write
+
+    pc.append_event_context("u1", [{"name": "Chess night", "reason": "chess", "score": 90}])
+
+    # The post-write metadata was cached, so the lagging replica is never asked.
+    assert [c["name"] for c in pc.get_event_context("u1")] == ["Chess night"]
+    assert pc.fetch_user_vector("u1").metadata["bio"] == "likes chess"
+
+
+def test_read_does_not_replace_write_through(fake_pinecone):
+    pc = fake_pinecone.module
+    pc.add_user_pinecone("u1", "ann", bio="likes chess")
+    shared_cache.record_user_write("u1", {"bio": "likes go"}, base={"bio": "likes chess"})
+    generation = shared_cache.user_generation("u1")
+
+    # A read that started after the write but hit a stale replica.
+    shared_cache.put_user_metadata("u1", {"bio": "likes chess"}, generation)
+
+    assert shared_cache.get_user_metadata("u1")["bio"] == "likes go"
+
+
+def test_write_without_base_drops_entry(fake_pinecone, monkeypatch):
+    pc = fake_pinecone.module
+    pc.add_user_pinecone("u1", "ann", bio="likes chess")
+    monkeypatch.setattr(shared_cache, "USER_VECTOR_TTL_S", -1)  # cached entry has expired
+
+    shared_cache.record_user_write("u1", {"bio": "likes go"})
+
+    monkeypatch.setattr(shared_cache, "USER_VECTOR_TTL_S", 300)
+    assert shared_cache.get_user_metadata("u1") is None
+
+
+def test_stale_generation_read_is_not_cached(fake_pinecone):
+    generation = shared_cache.user_generation("u2")
+    shared_cache.record_user_write("u2")
+    shared_cache.put_user_metadata("u2", {"bio": "old"}, generation)
+    assert shared_cache.get_user_metadata("u2") is None
+
+
+def test_warm_up_always_calls_the_embedding_api(fake_pinecone):
+    pc = fake_pinecone.module
+    pc.warm_up_pinecone()
+    pc.warm_up_pinecone()
+    assert fake_pinecone.embeds == ["warm up", "warm up"]
+
+
+def test_context_append_reads_pinecone_not_the_box_cache(fake_pinecone):
+    pc = fake_pinecone.module
+    pc.add_user_pinecone("u1", "ann", bio="likes chess")
+    pc.fetch_user_vector("u1")  # cached on this box
+    # Another instance (own /tmp cache) appends context straight to Pinecone.
+    fake_pinecone.index_for().update(
+        id="u1", set_metadata={"ctx_events": '[{"name": "Go club", "reason": "go", "score": 50}]'}
+    )
+
+    pc.append_event_context("u1", [{"name": "Chess night", "reason": "chess", "score": 90}])
+
+    stored = fake_pinecone.index_for().records["u1"]["metadata"]["ctx_events"]
+    assert "Go club" in stored and "Chess night" in stored
+    assert {c["name"] for c in pc.get_event_context("u1")} == {"Go club", "Chess night"}
@@ -0,0 +1,22 @@
+from helpers import warmup
+
+
+def test_failed_step_is_retried_until_ready(monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_RETRY_BASE_S", 0.01)
+    monkeypatch.setattr(warmup, "_state", {"started": False, "ready": False, "steps": {}, "attempts": 0, "duration_ms": None})
+    calls = {"ok": 0, "flaky": 0}
+
+    def ok():
+        calls["ok"] += 1
+
+    def flaky():
+        calls["flaky"] += 1
+        if calls["flaky"] < 3:
+            raise ConnectionError("boot blip")
+
+    warmup.start_warmup([("ok", ok), ("flaky", flaky)]).join(5)
+
+    status = warmup.warmup_status()
+    assert status["ready"] and status["attempts"] == 3
+    assert status["steps"] == {"ok": "ok", "flaky": "ok"}
+    assert calls == {"ok": 1, "flaky": 3}  # only the failed step is retried